@@ -1,64 +1,288 @@
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.api_core.exceptions import ResourceExhausted
 import os
+import sys
 import pandas as pd
-from dotenv import load_dotenv
-import re
+import numpy as np
 import json as _json
-from indicators import calculate_indicators
-from portfolio_manager import add_llm_reflection_log, load_portfolio_state, save_portfolio_state
-from config import LLM_PROMPT_TEMPLATE, RISK_MANAGEMENT_VARS
+import threading
+import hashlib
+import time
+import itertools
+import re
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from numba import njit
+except ImportError:  # numba is optional (newer pandas_ta installs it); fall back to plain NumPy
+    njit = None
+from indicators import calculate_indicators_cached
+from portfolio_manager import add_llm_reflection_log, load_portfolio_state, save_portfolio_state, portfolio_state_path, read_json, write_json
+from config import LLM_PROMPT_TEMPLATE, LLM_BATCH_RESPONSE_INSTRUCTIONS, RISK_MANAGEMENT_VARS, ANALYSIS_MAX_WORKERS, GEMINI_MAX_CONCURRENT_REQUESTS, LLM_CACHE_TTL_SECONDS, GEMINI_API_KEY, GEMINI_API_KEYS, GEMINI_KEY_COOLDOWN_SECONDS
 from datetime import datetime
 
-load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 genai.configure(api_key=GEMINI_API_KEY)
 
 # Initialize the Gemini model
-model = genai.GenerativeModel('models/gemini-1.5-flash-latest')
+GEMINI_MODEL_NAME = 'models/gemini-1.5-flash-latest'
+model = genai.GenerativeModel(GEMINI_MODEL_NAME)
 
-def get_llm_analysis(symbol, current_price, recent_history_df, news_df, past_trades_summary=""):
+# --- Gemini API key pool ---
+def _make_model(api_key):
     """
-    Gets Gemini's analysis, sentiment, and suggested action for a given asset.
+    Builds a GenerativeModel bound to its own API key. genai.configure is global and the SDK has no public
+    per-model key, so this sets GenerativeModel._client, which generate_content only fills lazily with the
+    default client while it is None. Checked against google-generativeai 0.8.6; raises instead of silently
+    falling back to the global key if a later version drops or pre-fills that attribute.
     """
-    # Always use the latest prompt template from state
-    state = load_portfolio_state()
-    prompt_template = state.get("llm_prompt_template", LLM_PROMPT_TEMPLATE)
+    key_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    if not hasattr(key_model, "_client") or key_model._client is not None:
+        raise RuntimeError(
+            f"google-generativeai {genai.__version__} no longer exposes an unset GenerativeModel._client; "
+            "the per-key model pool (GEMINI_API_KEYS) needs updating for this SDK version."
+        )
+    key_model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+    return key_model
+
+_models = [_make_model(key) for key in GEMINI_API_KEYS] if len(GEMINI_API_KEYS) > 1 else [model]
+_model_order = itertools.cycle(range(len(_models)))
+_model_cooldown_until = {}  # model index -> time.monotonic() when the key may be used again
+_model_lock = threading.Lock()
+# Models are shared across worker threads; one semaphore per key caps how many requests each key has in flight
+_gemini_semaphores = [threading.Semaphore(GEMINI_MAX_CONCURRENT_REQUESTS) for _ in _models]
+
+def _next_model():
+    """Picks the next key round-robin, skipping keys that are cooling down after a rate limit."""
+    with _model_lock:
+        now = time.monotonic()
+        for _ in range(len(_models)):
+            i = next(_model_order)
+            if _model_cooldown_until.get(i, 0) <= now:
+                return i, _models[i]
+        # Every key is cooling down; use the one that frees up first
+        i = min(_model_cooldown_until, key=_model_cooldown_until.get)
+        return i, _models[i]
+
+def _call_gemini(call):
+    """Runs call(model) with the next available key. On a 429 the key is parked and the next key is tried."""
+    last_error = None
+    for _ in range(len(_models)):
+        i, key_model = _next_model()
+        try:
+            with _gemini_semaphores[i]:
+                return call(key_model)
+        except ResourceExhausted as e:
+            print(f"Gemini key #{i + 1} hit its rate limit, skipping it for {GEMINI_KEY_COOLDOWN_SECONDS}s.")
+            with _model_lock:
+                _model_cooldown_until[i] = time.monotonic() + GEMINI_KEY_COOLDOWN_SECONDS
+            last_error = e
+    raise last_error
+
+_json_decoder = _json.JSONDecoder()
+
+def _extract_json_object(text, partial=False):
+    """
+    Returns the first JSON object embedded in text (e.g. wrapped in markdown or prose), or None.
+    Decodes from each '{' with raw_decode rather than a regex, so nested objects parse correctly
+    and long responses can't trigger backtracking.
+    With partial=True, text may be a truncated stream: an object that runs past the end of text stops
+    the scan, so a nested object inside it is never returned in place of the whole one.
+    """
+    start = text.find('{')
+    while start != -1:
+        try:
+            obj, _ = _json_decoder.raw_decode(text, start)
+            if isinstance(obj, dict):
+                return obj
+        except ValueError as e:
+            if partial and (getattr(e, 'pos', -1) >= len(text) or str(e).startswith("Unterminated string")):
+                return None
+        start = text.find('{', start + 1)
+    return None
+
+def _stream_json_response(llm_model, prompt):
+    """
+    Streams a Gemini response and tries to decode the top-level JSON object as soon as a closing brace arrives.
+    Returns (text received, parsed dict or None). Stops reading the stream once the object is complete.
+    """
+    parts = []
+    for chunk in llm_model.generate_content(prompt, stream=True):
+        parts.append(chunk.text)
+        if '}' in chunk.text:
+            text = "".join(parts)
+            obj = _extract_json_object(text, partial=True)
+            if obj is not None:
+                return text.strip(), obj
+            # Object not complete yet, keep reading
+    return "".join(parts).strip(), None
+
+# --- LLM analysis cache (in-memory, persisted to disk so restarts within a cycle can reuse it) ---
+LLM_CACHE_FILE = "llm_analysis_cache.json"
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def _llm_cache_key(symbol, prompt):
+    """Fingerprint of an analysis: the symbol plus the full rendered prompt, so any input the model sees is covered."""
+    h = hashlib.sha256()
+    h.update(f"{symbol}\n".encode())
+    h.update(prompt.encode())
+    return h.hexdigest()
+
+def _load_llm_cache():
+    """Loads the analysis cache from disk on first use. Caller must hold _llm_cache_lock."""
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = {}
+        if os.path.exists(LLM_CACHE_FILE):
+            try:
+                _llm_cache = read_json(LLM_CACHE_FILE)
+            except Exception as e:
+                print(f"Error loading LLM cache, starting empty: {e}")
+    return _llm_cache
+
+def _get_cached_analysis(key):
+    with _llm_cache_lock:
+        entry = _load_llm_cache().get(key)
+    if entry and time.time() - entry['timestamp'] < LLM_CACHE_TTL_SECONDS:
+        return dict(entry['result'])
+    return None
+
+def _store_cached_analysis(key, result):
+    with _llm_cache_lock:
+        cache = _load_llm_cache()
+        now = time.time()
+        # Drop expired entries so the file doesn't grow without bound
+        for k in [k for k, v in cache.items() if now - v['timestamp'] >= LLM_CACHE_TTL_SECONDS]:
+            del cache[k]
+        cache[key] = {'timestamp': now, 'result': {k: v for k, v in result.items() if k != 'raw_prompt_sent'}}
+        try:
+            write_json(LLM_CACHE_FILE, cache)
+        except Exception as e:
+            print(f"Error saving LLM cache: {e}")
 
+# --- Prompt template cache (only re-read the state file when it changes on disk) ---
+_prompt_cache = {"mtime": None, "template": LLM_PROMPT_TEMPLATE}
+_prompt_cache_lock = threading.Lock()
+
+def _get_prompt_template():
+    """Returns the latest prompt template from portfolio state, reloading only when the state file's mtime changes."""
+    try:
+        mtime = os.stat(portfolio_state_path()).st_mtime
+    except OSError:
+        return LLM_PROMPT_TEMPLATE
+    with _prompt_cache_lock:
+        if _prompt_cache["mtime"] != mtime:
+            state = load_portfolio_state()
+            _prompt_cache["template"] = state.get("llm_prompt_template", LLM_PROMPT_TEMPLATE)
+            _prompt_cache["mtime"] = mtime
+        return _prompt_cache["template"]
+
+# --- Prompt rendering (templates are split into parts once, then filled by concatenation) ---
+_PROMPT_FIELDS = ("symbol", "current_price", "history_str", "news_str", "past_trades_summary")
+_PROMPT_FIELD_RE = re.compile(r"\{(" + "|".join(_PROMPT_FIELDS) + r")\}")
+
+@lru_cache(maxsize=8)
+def _compile_prompt_template(template):
+    """
+    Splits a prompt template into literal text and placeholder names.
+    Only the known placeholders are substituted, so literal JSON braces in the template need no escaping;
+    doubled braces written for str.format (e.g. in LLM-suggested templates) are collapsed to single ones.
+    """
+    parts = _PROMPT_FIELD_RE.split(template)
+    literals = tuple(part.replace("{{", "{").replace("}}", "}") for part in parts[0::2])
+    return literals, tuple(parts[1::2])
+
+def render_prompt(template, **values):
+    """Fills a prompt template's placeholders from values."""
+    literals, fields = _compile_prompt_template(template)
+    out = [literals[0]]
+    for name, literal in zip(fields, literals[1:]):
+        out.append(str(values[name]))
+        out.append(literal)
+    return "".join(out)
+
+# --- Indicator trend kernel ---
+_TREND_LABELS = {1: "rising", -1: "falling", 0: "flat"}
+_TREND_INCOMPLETE = 2  # Column has a NaN in its last 5 bars, no trend reported
+
+def _trend_codes_loop(values):
+    """Trend code per column of a 2D float array over its last 5 rows: 1 rising, -1 falling, 0 flat, 2 incomplete."""
+    n_rows, n_cols = values.shape
+    codes = np.full(n_cols, _TREND_INCOMPLETE, dtype=np.int8)
+    if n_rows < 5:
+        return codes
+    for j in range(n_cols):
+        complete = True
+        for i in range(n_rows - 5, n_rows):
+            if np.isnan(values[i, j]):
+                complete = False
+                break
+        if complete:
+            first = values[n_rows - 5, j]
+            last = values[n_rows - 1, j]
+            if last > first:
+                codes[j] = 1
+            elif last < first:
+                codes[j] = -1
+            else:
+                codes[j] = 0
+    return codes
+
+def _trend_codes_numpy(values):
+    """Vectorized NumPy equivalent of _trend_codes_loop, used when numba isn't installed."""
+    codes = np.full(values.shape[1], _TREND_INCOMPLETE, dtype=np.int8)
+    if len(values) < 5:
+        return codes
+    last5 = values[-5:]
+    complete = ~np.isnan(last5).any(axis=0)
+    codes[complete] = np.sign(last5[-1] - last5[0])[complete]
+    return codes
+
+# cache=True stores the compiled kernel on disk so later runs skip the JIT step.
+# No fastmath: it would let numba assume NaNs never occur and break the completeness check.
+_trend_codes = njit(cache=True)(_trend_codes_loop) if njit is not None else _trend_codes_numpy
+if njit is not None:
+    # Compile (or load from the on-disk cache) in the background so the first trading cycle doesn't pay for it
+    threading.Thread(target=_trend_codes, args=(np.zeros((5, 1)),), daemon=True, name="trend-kernel-warmup").start()
+
+def _build_analysis_prompt(prompt_template, symbol, current_price, recent_history_df, news_df, past_trades_summary=""):
+    """Fills the analysis prompt template with the history, indicator and news sections for one asset."""
     # Prepare recent history string
     history_str = ""
     if not recent_history_df.empty:
-        # Add more indicators for LLM prompt
-        indicator_cols = [col for col in recent_history_df.columns if col not in ["Date"]]
-        history_str = recent_history_df[indicator_cols].to_string(index=True)
-
-    # Dynamically use all indicator columns (exclude 'Date' and non-numeric columns)
-    if not recent_history_df.empty:
-        indicator_cols = [col for col in recent_history_df.columns if col not in ["Date"] and pd.api.types.is_numeric_dtype(recent_history_df[col])]
+        # Add more indicators for LLM prompt (compact CSV: fewer tokens than to_string's padded columns).
+        # Passing columns= lets to_csv select them without first copying the frame.
+        history_cols = [col for col in recent_history_df.columns if col != "Date"]
+        history_str = recent_history_df.to_csv(columns=history_cols, float_format='%.3f').rstrip("\n")
+
+        # Dynamically use all indicator columns (exclude 'Date' and non-numeric columns).
+        # One select_dtypes pass; the column index and the float array are reused for the summary and trends.
+        num_df = recent_history_df.select_dtypes('number')
+        indicator_cols = num_df.columns
+        values = num_df.to_numpy(dtype=float)
         # Add summary of most recent values for all indicators
-        last_row = recent_history_df.iloc[-1]
-        indicator_summary = [f"{ind}: {last_row[ind]:.2f}" for ind in indicator_cols if ind in last_row and pd.notnull(last_row[ind])]
+        last_vals = values[-1]
+        indicator_summary = [f"{ind}: {val:.2f}" for ind, val in zip(indicator_cols, last_vals) if not np.isnan(val)]
         if indicator_summary:
             history_str += "\n\nLatest Indicator Values: " + ", ".join(indicator_summary)
-        # Add trend lines for all indicators
-        trend_lines = []
-        for ind in indicator_cols:
-            if ind in recent_history_df.columns:
-                last_vals = recent_history_df[ind].tail(5).tolist()
-                if len(last_vals) == 5 and all(pd.notnull(last_vals)):
-                    if last_vals[-1] > last_vals[0]:
-                        trend = "rising"
-                    elif last_vals[-1] < last_vals[0]:
-                        trend = "falling"
-                    else:
-                        trend = "flat"
-                    trend_lines.append(f"{ind} trend over last 5 bars: {trend}")
+        # Add trend lines for all indicators (only columns with 5 complete bars)
+        trend_codes = _trend_codes(np.ascontiguousarray(values))
+        trend_lines = [f"{ind} trend over last 5 bars: {_TREND_LABELS[code]}" for ind, code in zip(indicator_cols, trend_codes) if code != _TREND_INCOMPLETE]
         if trend_lines:
             history_str += "\n" + "\n".join(trend_lines)
 
+    # Drop wire copies of the same story (identical title ignoring case/whitespace) to save prompt tokens
+    if not news_df.empty:
+        normalized_titles = news_df['title'].astype(str).str.lower().str.split().str.join(" ")
+        news_df = news_df[~normalized_titles.duplicated()]
+
     # Prepare news headlines string
     news_str = ""
     if not news_df.empty:
-        news_str = "\n".join([f"- {row['title']} (Source: {row.get('source','N/A')})" for index, row in news_df.iterrows()])
+        titles = news_df['title'].to_numpy()
+        sources = news_df['source'].fillna('N/A').to_numpy() if 'source' in news_df.columns else ['N/A'] * len(news_df)
+        news_str = "\n".join(f"- {title} (Source: {source})" for title, source in zip(titles, sources))
 
     # Add a summary of the most recent news headline for LLM prompt clarity
     if not news_df.empty:
@@ -66,7 +290,8 @@ def get_llm_analysis(symbol, current_price, recent_history_df, news_df, past_tra
         news_str += f"\n\nMost recent headline: {latest_news['title']} (Published: {latest_news.get('created_at', 'N/A')})"
 
     # --- LLM Prompt Improvements ---
-    prompt = prompt_template.format(
+    return render_prompt(
+        prompt_template,
         symbol=symbol,
         current_price=current_price,
         history_str=history_str,
@@ -74,9 +299,25 @@ def get_llm_analysis(symbol, current_price, recent_history_df, news_df, past_tra
         past_trades_summary=past_trades_summary if past_trades_summary else "No specific past performance to reflect on yet."
     )
 
+def get_llm_analysis(symbol, current_price, recent_history_df, news_df, past_trades_summary="", force_refresh=False):
+    """
+    Gets Gemini's analysis, sentiment, and suggested action for a given asset.
+    Results are cached for LLM_CACHE_TTL_SECONDS; pass force_refresh=True to always query Gemini.
+    """
+    # Always use the latest prompt template from state
+    prompt_template = _get_prompt_template()
+    prompt = _build_analysis_prompt(prompt_template, symbol, current_price, recent_history_df, news_df, past_trades_summary)
+
+    cache_key = _llm_cache_key(symbol, prompt)
+    if not force_refresh:
+        cached = _get_cached_analysis(cache_key)
+        if cached is not None:
+            print(f"Using cached Gemini analysis for {symbol}.")
+            cached['raw_prompt_sent'] = prompt
+            return cached
+
     try:
-        response = model.generate_content(prompt)
-        analysis_text = response.text.strip()
+        analysis_text, result = _call_gemini(lambda key_model: _stream_json_response(key_model, prompt))
         print(f"\n--- Gemini Analysis for {symbol} ---")
         print(analysis_text)
         print("--------------------------------------")
@@ -84,13 +325,12 @@ def get_llm_analysis(symbol, current_price, recent_history_df, news_df, past_tra
         # Parse the JSON response
         try:
             # Try to extract the first JSON object if Gemini returns extra text or markdown
-            json_match = re.search(r'\{[\s\S]*?\}', analysis_text)
-            if json_match:
-                json_str = json_match.group(0)
-            else:
-                json_str = analysis_text
-            result = _json.loads(json_str)
+            if result is None:
+                result = _extract_json_object(analysis_text)
+            if result is None:
+                result = _json.loads(analysis_text)
             result['raw_prompt_sent'] = prompt
+            _store_cached_analysis(cache_key, result)
             return result
         except Exception as e:
             print(f"Error parsing Gemini JSON: {e}")
@@ -112,40 +352,81 @@ def get_llm_analysis(symbol, current_price, recent_history_df, news_df, past_tra
         print(f"Error querying Gemini for {symbol}: {e}")
         return {"sentiment": 0, "action": "HOLD", "reasoning": f"Error: {e}", "risks": "API Call Failed", "raw_prompt_sent": prompt}
 
-# (Assuming LLM analysis, portfolio manager functions are available)
-
-def reflect_and_learn(llm_model, portfolio_state):
+def get_llm_analysis_batch(payloads, force_refresh=False):
     """
-    Feeds past trade outcomes to Gemini for reflection and learning.
-    After reflection, parses for prompt/parameter suggestions and updates state if needed.
+    Gets Gemini's analysis for several assets with a single request.
+    payloads: list of dicts with the get_llm_analysis arguments (symbol, current_price, recent_history_df, news_df, past_trades_summary).
+    Returns a dict of symbol -> analysis result in the same shape as get_llm_analysis.
+    Cached symbols are answered locally; only the rest are sent to Gemini.
     """
-    trade_log = portfolio_state.get("trade_log", [])
-    if not trade_log:
-        print("No trades in log to reflect on.")
-        return
+    prompt_template = _get_prompt_template()
+    results = {}
+    pending = []
+    for payload in payloads:
+        symbol = payload['symbol']
+        prompt = _build_analysis_prompt(
+            prompt_template, symbol, payload['current_price'], payload['recent_history_df'],
+            payload['news_df'], payload.get('past_trades_summary', "")
+        )
+        cache_key = _llm_cache_key(symbol, prompt)
+        cached = None if force_refresh else _get_cached_analysis(cache_key)
+        if cached is not None:
+            print(f"Using cached Gemini analysis for {symbol}.")
+            cached['raw_prompt_sent'] = prompt
+            results[symbol] = cached
+        else:
+            pending.append((symbol, prompt, cache_key))
+
+    if not pending:
+        return results
+
+    sections = [f"=== Asset {i} of {len(pending)}: {symbol} ===\n{prompt}" for i, (symbol, prompt, _) in enumerate(pending, 1)]
+    batch_prompt = "\n\n".join(sections) + "\n\n" + LLM_BATCH_RESPONSE_INSTRUCTIONS.format(count=len(pending))
 
-    # Take a subset of recent trades for reflection to save on tokens/quota
-    recent_trades_for_reflection = trade_log[-5:] # Reflect on last 5 trades
-
-    # Build the allowed parameters section dynamically
-    allowed_params = {k: v['range'] for k, v in RISK_MANAGEMENT_VARS.items() if v.get('use_in_llm')}
-    allowed_params_str = '\n'.join([
-        f"- {k} ({v[0]} to {v[1]})" for k, v in allowed_params.items()
-    ])
-
-    reflection_prompt = f"""
-    You are an expert trading AI. Review the following past trades and your previous reasoning.
-    Analyze the outcomes and identify areas for improvement in your decision-making.
+    try:
+        analysis_text, parsed = _call_gemini(lambda key_model: _stream_json_response(key_model, batch_prompt))
+        print(f"\n--- Gemini Batch Analysis for {', '.join(symbol for symbol, _, _ in pending)} ---")
+        print(analysis_text)
+        print("--------------------------------------")
+    except Exception as e:
+        print(f"Error querying Gemini for batch: {e}")
+        for symbol, prompt, _ in pending:
+            results[symbol] = {"sentiment": 0, "action": "HOLD", "reasoning": f"Error: {e}", "risks": "API Call Failed", "raw_prompt_sent": prompt}
+        return results
+
+    if parsed is None:
+        parsed = _extract_json_object(analysis_text) or {}
+    by_symbol = {}
+    for entry in parsed.get('results', []):
+        if isinstance(entry, dict) and 'symbol' in entry and 'action' in entry and 'sentiment' in entry:
+            by_symbol[str(entry['symbol']).upper()] = entry
+
+    for symbol, prompt, cache_key in pending:
+        result = by_symbol.get(symbol.upper())
+        if result is None:
+            print(f"Error parsing Gemini JSON: no valid batch result for {symbol}")
+            results[symbol] = {
+                "sentiment": 0,
+                "action": "HOLD",
+                "reasoning": analysis_text,
+                "risks": "JSON Parse Failed",
+                "raw_response": analysis_text,
+                "raw_prompt_sent": prompt
+            }
+            continue
+        result = {k: v for k, v in result.items() if k != 'symbol'}
+        result['raw_prompt_sent'] = prompt
+        _store_cached_analysis(cache_key, result)
+        results[symbol] = result
+    return results
 
-    --- My Recent Trades ---
-    """
-    for trade in recent_trades_for_reflection:
-        reflection_prompt += f"Symbol: {trade.get('symbol')}, Action: {trade.get('action')}, " \
-                             f"Size: {trade.get('size')}, Price: {trade.get('price')}, " \
-                             f"Outcome: Realized P&L: ${trade.get('trade_outcome_pl', 0):.2f}, " \
-                             f"My Reasoning: {trade.get('llm_reasoning', 'N/A')}\n"
+# (Assuming LLM analysis, portfolio manager functions are available)
 
-    reflection_prompt += f"""
+# Parameters the reflection step may tune, with their (min, max) ranges. RISK_MANAGEMENT_VARS is static, so build these once.
+_ALLOWED_PARAMS = {k: v['range'] for k, v in RISK_MANAGEMENT_VARS.items() if v.get('use_in_llm')}
+_ALLOWED_PARAMS_STR = '\n'.join(f"- {k} ({lo} to {hi})" for k, (lo, hi) in _ALLOWED_PARAMS.items())
+# Everything after the trade list is the same on every reflection
+_REFLECTION_PROMPT_TAIL = f"""
     --- Reflection Questions ---
     1. What patterns or insights can you identify from these outcomes (successes or failures)?
     2. Where did your previous reasoning align with the outcome, and where did it diverge?
@@ -155,7 +436,7 @@ def reflect_and_learn(llm_model, portfolio_state):
     Provide a concise but insightful reflection.
 
     You may suggest changes to the following parameters only (with suggested value ranges):
-{allowed_params_str}
+{_ALLOWED_PARAMS_STR}
 
     If you believe a new risk or strategy variable should be added to the system (for example, a new threshold, a new type of limit, or a new adaptive rule), suggest it in a field called "new_variable_suggestions" in your JSON output. For each, provide:
       - variable_name: a concise name for the new variable
@@ -200,9 +481,40 @@ def reflect_and_learn(llm_model, portfolio_state):
     If you have no suggestions, output an empty JSON object: {{}}
     """
 
+def reflect_and_learn(llm_model, portfolio_state, save_state=True):
+    """
+    Feeds past trade outcomes to Gemini for reflection and learning.
+    After reflection, parses for prompt/parameter suggestions and updates state if needed.
+    Pass save_state=False when the caller persists portfolio_state itself, to skip a full rewrite of the state file.
+    The request goes through the Gemini key pool like the analysis calls; llm_model is kept for existing callers.
+    """
+    trade_log = portfolio_state.get("trade_log", [])
+    if not trade_log:
+        print("No trades in log to reflect on.")
+        return
+
+    # Take a subset of recent trades for reflection to save on tokens/quota
+    recent_trades_for_reflection = trade_log[-5:] # Reflect on last 5 trades
+
+    reflection_prompt = f"""
+    You are an expert trading AI. Review the following past trades and your previous reasoning.
+    Analyze the outcomes and identify areas for improvement in your decision-making.
+
+    --- My Recent Trades ---
+    """
+    reflection_prompt += "".join(
+        f"Symbol: {trade.get('symbol')}, Action: {trade.get('action')}, "
+        f"Size: {trade.get('size')}, Price: {trade.get('price')}, "
+        f"Outcome: Realized P&L: ${trade.get('trade_outcome_pl', 0):.2f}, "
+        f"My Reasoning: {trade.get('llm_reasoning', 'N/A')}\n"
+        for trade in recent_trades_for_reflection
+    )
+
+    reflection_prompt += _REFLECTION_PROMPT_TAIL
+
     try:
-        response = llm_model.generate_content(reflection_prompt)
-        reflection_text = response.text
+        # The JSON suggestions close the reflection, so the stream ends once they parse
+        reflection_text, suggestions = _call_gemini(lambda key_model: _stream_json_response(key_model, reflection_prompt))
         print("\n--- Gemini Reflection ---")
         print(reflection_text)
         print("-------------------------")
@@ -215,13 +527,11 @@ def reflect_and_learn(llm_model, portfolio_state):
         add_llm_reflection_log(portfolio_state, reflection_details)
 
         # --- Parse for JSON suggestions ---
-        json_match = re.search(r'\{[\s\S]*\}', reflection_text)
-        suggestions = {}
-        if json_match:
-            try:
-                suggestions = _json.loads(json_match.group(0))
-            except Exception as e:
-                print(f"Error parsing LLM JSON suggestions: {e}")
+        if suggestions is None:
+            suggestions = _extract_json_object(reflection_text)
+        if suggestions is None:
+            print("No parseable JSON suggestions found in LLM reflection.")
+            suggestions = {}
         prompt_suggestion = suggestions.get('prompt_suggestion')
         param_suggestions = suggestions.get('param_suggestions', {})
         # --- New: Capture any new variable suggestions ---
@@ -257,7 +567,7 @@ def reflect_and_learn(llm_model, portfolio_state):
                 'reflection_excerpt': str(prompt_suggestion)
             })
         # Update parameters if suggested (with min/max safeguards)
-        minmax = allowed_params
+        minmax = _ALLOWED_PARAMS
         for k, v in param_suggestions.items():
             if k in minmax:
                 minv, maxv = minmax[k]
@@ -277,7 +587,8 @@ def reflect_and_learn(llm_model, portfolio_state):
                     })
                 except Exception:
                     continue
-        save_portfolio_state(portfolio_state)
+        if save_state:
+            save_portfolio_state(portfolio_state)
     except Exception as e:
         print(f"Error during LLM reflection: {e}")
 
@@ -291,50 +602,57 @@ def reflect_and_learn(llm_model, portfolio_state):
 #    save_portfolio_state(current_state)
 
 if __name__ == "__main__":
-    # List available Gemini models before running analysis
-    print("Available Gemini models:")
-    for m in genai.list_models():
-        print(f"- {getattr(m, 'name', m)}")
+    # Listing models is a network round-trip, so only do it on request
+    if "--list-models" in sys.argv:
+        print("Available Gemini models:")
+        for m in genai.list_models():
+            print(f"- {getattr(m, 'name', m)}")
     print("\n--- Running analysis with selected model ---\n")
     
     # Example usage for both AAPL and BTC-USD (or any available symbol)
-    from data_collector import get_historical_trade_data, get_financial_news
+    from data_collector import get_historical_trade_data, get_financial_news_batch
     symbols = ["AAPL", "BTC-USD", "ETH-USD", "GOOGL", "AMZN"]  # Add more symbols as needed
+
+    def collect_symbol_inputs(symbol):
+        """Fetches data for one symbol and pairs it with its news. Returns the get_llm_analysis_batch payload, or None if data is missing."""
+        try:
+            # Use data_collector methods to fetch data
+            data = get_historical_trade_data(symbol)
+            data = calculate_indicators_cached(symbol, data)
+            news = news_by_symbol.get(symbol)
+        except Exception as e:
+            print(f"Error fetching data for {symbol}: {e}. Skipping.")
+            return None
+
+        if data is None or data.empty:
+            print(f"No historical data for {symbol}, skipping.")
+            return None
+        if news is None or news.empty:
+            print(f"No news data for {symbol}, skipping.")
+            return None
+
+        return {
+            "symbol": symbol,
+            "current_price": data['Close'].iloc[-1],
+            "recent_history_df": data.tail(10),
+            "news_df": news,  # Already limited to articles mentioning this symbol
+            "past_trades_summary": ""  # You can load or pass past trade summaries here
+        }
+
     try:
-        for symbol in symbols:
-            try:
-                # Use data_collector methods to fetch data
-                data = get_historical_trade_data(symbol)
-                data = calculate_indicators(data)
-                news = get_financial_news(query=f"{symbol} stock", page_size=5)
-            except Exception as e:
-                print(f"Error fetching data for {symbol}: {e}. Skipping.")
-                continue
-
-            if data is None or data.empty:
-                print(f"No historical data for {symbol}, skipping.")
-                continue
-            if news is None or news.empty:
-                print(f"No news data for {symbol}, skipping.")
-                continue
-
-            current_price = data['Close'].iloc[-1]
-            recent_history = data.tail(10)
-            # Use only news related to the symbol (if possible)
-            news_specific = news[news['title'].str.contains(symbol.split('-')[0], case=False, na=False)]
-            news_for_llm = news_specific.head(5)
-
-            gemini_result = get_llm_analysis(
-                symbol=symbol,
-                current_price=current_price,
-                recent_history_df=recent_history,
-                news_df=news_for_llm,
-                past_trades_summary=""  # You can load or pass past trade summaries here
-            )
+        # One NewsAPI request covers every symbol
+        news_by_symbol = get_financial_news_batch(symbols, page_size_per_symbol=5)
+        # Data collection is dominated by network calls, so fetch all symbols concurrently
+        with ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS) as executor:
+            payloads = [p for p in executor.map(collect_symbol_inputs, symbols) if p is not None]
+
+        # One Gemini request covers every symbol
+        gemini_results = get_llm_analysis_batch(payloads)
+        for symbol, gemini_result in gemini_results.items():
             print(f"\nParsed Gemini Result for {symbol}:")
             print(f"Sentiment: {gemini_result['sentiment']}")
             print(f"Action: {gemini_result['action']}")
             print(f"Risks: {gemini_result['risks']}")
 
     except Exception as e:
-        print(f"An error occurred during Gemini batch execution: {e}")
\ No newline at end of file
+        print(f"An error occurred during Gemini batch execution: {e}")
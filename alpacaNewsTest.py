@@ -1,13 +1,10 @@
 
 import datetime
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
-ALPACA_API_KEY = os.getenv("ALPACA_API_KEY")
-ALPACA_SECRET_KEY = os.getenv("ALPACA_SECRET_KEY")
+from config import ALPACA_API_KEY, ALPACA_SECRET_KEY  # config loads .env once
 # Ensure you have your API keys set up, e.g., in a .env file
 # Or replace os.getenv with your actual keys for this test
 # from dotenv import load_dotenv
@@ -20,6 +17,15 @@ ALPACA_SECRET_KEY = os.getenv("ALPACA_SECRET_KEY")
 # always load from environment variables or a config file.
 # ------------------------------------------------
 
+# Reuse one pooled session so repeated calls skip the TCP/TLS handshake
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+_session.headers.update({
+    "accept": "application/json",
+    "APCA-API-KEY-ID": ALPACA_API_KEY,
+    "APCA-API-SECRET-KEY": ALPACA_SECRET_KEY
+})
+
 def run_news_api_test():
     # Get current time in UTC
     current_time_utc = datetime.datetime.now(datetime.timezone.utc)
@@ -38,17 +44,11 @@ def run_news_api_test():
     url = (f"https://data.alpaca.markets/v1beta1/news?"
            f"start={start_str}&end={end_str}&sort=desc&symbols={test_symbols}&limit={limit}")
 
-    headers = {
-        "accept": "application/json",
-        "APCA-API-KEY-ID": ALPACA_API_KEY,
-        "APCA-API-SECRET-KEY": ALPACA_SECRET_KEY
-    }
-
     print(f"--- Running Alpaca News API Test ---")
     print(f"Querying for news from {start_str} to {end_str} for symbols: {test_symbols}")
 
     try:
-        response = requests.get(url, headers=headers)
+        response = _session.get(url, timeout=10)
         response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
         news_data = response.json()
 
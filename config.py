@@ -1,4 +1,6 @@
 import os
+import sys
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv() # This loads variables from .env
@@ -7,16 +9,28 @@ ALPACA_API_KEY = os.getenv("ALPACA_API_KEY")
 ALPACA_SECRET_KEY = os.getenv("ALPACA_SECRET_KEY")
 NEWS_API_KEY = os.getenv("NEWS_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Optional comma-separated pool of Gemini keys; requests rotate across them to spread the per-key rate limit
+GEMINI_API_KEYS = [k.strip() for k in os.getenv("GEMINI_API_KEYS", "").split(",") if k.strip()] or [GEMINI_API_KEY]
 BASE_URL = os.getenv("ALPACA_BASE_URL", "https://paper-api.alpaca.markets")
 
 # --- User Configuration ---
-TRADING_SYMBOLS = ["NKE", "PFE", "NVDA", "TSLA", "META", "BTC-USD", "ETH-USD", "AMZN", "AAPL", "GOOGL"]
+# Interned so symbol-keyed dict lookups across modules compare by identity
+TRADING_SYMBOLS = [sys.intern(s) for s in ["NKE", "PFE", "NVDA", "TSLA", "META", "BTC-USD", "ETH-USD", "AMZN", "AAPL", "GOOGL"]]
 CYCLE_INTERVAL_SECONDS = 60 * 30 # Run every 30 minutes
 LOOKBACK_PERIOD_HISTORY = "14D" # Use 14 days of history for intraday bars
 BAR_GRANULARITY = '30Min'  # 30-minute bars for intraday trading
 NEWS_QUERY_LIMIT_PER_SYMBOL = 3 # Max 3 relevant news articles for LLM per symbol
 LLM_REFLECTION_INTERVAL_CYCLES = 6 # Reflect every 6 cycles 
 NEWS_FETCH_INTERVAL_CYCLES = 1  # Fetch/process news every cycle (30 min)
+ANALYSIS_MAX_WORKERS = 8 # Max symbols analyzed concurrently (data fetch + LLM call are I/O-bound)
+ALPACA_MAX_CONCURRENT_REQUESTS = 8 # Max in-flight Alpaca data requests, keeps us well under the 200 requests/min limit
+GEMINI_MAX_CONCURRENT_REQUESTS = 4 # Max in-flight Gemini requests per API key, keeps us under the per-minute quota
+GEMINI_KEY_COOLDOWN_SECONDS = 60 # How long a Gemini key is skipped after it hits a rate limit (HTTP 429)
+LLM_CACHE_TTL_SECONDS = CYCLE_INTERVAL_SECONDS # Reuse an LLM analysis for unchanged inputs for up to one cycle
+STATE_FLUSH_INTERVAL_SECONDS = 10 # Coalesce deferred portfolio state saves made within this window into one write
+ADAPTATION_LOG_MAX_ENTRIES = 500 # adaptation_log entries kept in memory and loaded back from its log file; the anomaly checks only read the last 20
+LOG_ADAPTATION_SUMMARY = os.getenv("LOG_ADAPTATION_SUMMARY", "1") != "0" # Set to 0 on headless runs to skip building the 10-cycle adaptation summary
+COMPRESS_PORTFOLIO_STATE = os.getenv("COMPRESS_PORTFOLIO_STATE", "0") == "1" # Store the state and its backup zstd-compressed (.zst); needs zstandard
 
 RISK_SETTINGS = {
     "max_risk_per_trade_percent": 0.05,  # 5% of portfolio value per trade
@@ -46,18 +60,32 @@ MAX_SIMILAR_RECORDS = 5 # Max number of similar past experiences to consider
 
 # LLM prompt template for all LLM-based analysis (single source of truth)
 TRADING_GOAL_DESCRIPTION = "My primary goal is to execute lots of small, high-frequency trades with a higher risk tolerance."
-CYCLE_INTERVAL_SECONDS = 1800  # Example: 30 minutes
-LLM_PROMPT_TEMPLATE = (
-    f"{TRADING_GOAL_DESCRIPTION}\n\n"
-    f"The current trading cycle is {CYCLE_INTERVAL_SECONDS // 60} minutes.\n\n"
-    "You are an expert financial analyst. Analyze the following information for {symbol}:\n\n"
-    "Current Price: ${current_price}\n\n"
-    "Recent Price History & Technical Indicators (last few days/weeks, simplified):\n{history_str}\n\n"
-    "Recent News Headlines (from real-time Alpaca WebSocket, most relevant to this cycle):\n{news_str}\n\n"
-    "Past Trading Performance/Reflections (my AI's previous actions/outcomes for this asset):\n{past_trades_summary}\n\n"
-    "---\n"
-    "You have access to the following technical indicators: SMA_20, RSI, MACD, Bollinger Bands, OBV, ATR, and others. "
-    "Use them in your analysis and explain how they influence your recommendation. If news headlines are present, consider their immediate impact for this cycle.\n\n"
-    "Based on this data, provide your response in the following strict JSON format (do not include any explanation, ```json, or text outside the JSON):\n"
-    "{\n  \"sentiment\": <integer from -100 to 100>,\n  \"action\": \"BUY\" | \"SELL\" | \"HOLD\",\n  \"reasoning\": <string>,\n  \"risks\": <string>\n}\n"
-)
\ No newline at end of file
+
+@lru_cache(maxsize=4)
+def get_llm_prompt_template(cycle_seconds=CYCLE_INTERVAL_SECONDS):
+    """Assembles the base LLM prompt template for a given cycle length (cached per cycle length)."""
+    return (
+        f"{TRADING_GOAL_DESCRIPTION}\n\n"
+        f"The current trading cycle is {cycle_seconds // 60} minutes.\n\n"
+        "You are an expert financial analyst. Analyze the following information for {symbol}:\n\n"
+        "Current Price: ${current_price}\n\n"
+        "Recent Price History & Technical Indicators (last few days/weeks, simplified):\n{history_str}\n\n"
+        "Recent News Headlines (from real-time Alpaca WebSocket, most relevant to this cycle):\n{news_str}\n\n"
+        "Past Trading Performance/Reflections (my AI's previous actions/outcomes for this asset):\n{past_trades_summary}\n\n"
+        "---\n"
+        "You have access to the following technical indicators: SMA_20, RSI, MACD, Bollinger Bands, OBV, ATR, and others. "
+        "Use them in your analysis and explain how they influence your recommendation. If news headlines are present, consider their immediate impact for this cycle.\n\n"
+        "Based on this data, provide your response in the following strict JSON format (do not include any explanation, ```json, or text outside the JSON):\n"
+        "{\n  \"sentiment\": <integer from -100 to 100>,\n  \"action\": \"BUY\" | \"SELL\" | \"HOLD\",\n  \"reasoning\": <string>,\n  \"risks\": <string>\n}\n"
+    )
+
+LLM_PROMPT_TEMPLATE = get_llm_prompt_template(CYCLE_INTERVAL_SECONDS)
+
+# Appended once when several assets are analyzed in a single LLM request (see ai_brain.get_llm_analysis_batch)
+LLM_BATCH_RESPONSE_INSTRUCTIONS = (
+    "===\n"
+    "You were given {count} assets above. Instead of one JSON object per asset, respond with a single JSON object "
+    "(do not include any explanation, ```json, or text outside the JSON) of the form:\n"
+    "{{\"results\": [{{\"symbol\": <string>, \"sentiment\": <integer from -100 to 100>, \"action\": \"BUY\" | \"SELL\" | \"HOLD\", \"reasoning\": <string>, \"risks\": <string>}}, ...]}}\n"
+    "Include exactly one entry per asset and use each symbol exactly as given.\n"
+)
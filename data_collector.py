@@ -1,33 +1,118 @@
-import yfinance as yf
 import pandas as pd
 import os
 import asyncio
-import websockets
+import contextlib
 import json
-import alpaca_trade_api as tradeapi
-from config import ALPACA_API_KEY, ALPACA_SECRET_KEY, LOOKBACK_PERIOD_HISTORY, BAR_GRANULARITY, BASE_URL
+from collections import deque
+from itertools import islice
+from functools import lru_cache
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+# yfinance, alpaca_trade_api, newsapi and websockets are imported where they are used: they are slow to import
+# and each is only needed on one path (e.g. yfinance only when the Alpaca fetch fails)
+try:
+    import pyarrow  # noqa: F401  (enables DataFrame.to_parquet)
+except ImportError:  # pyarrow is optional; history is saved as CSV without it
+    pyarrow = None
+from portfolio_manager import write_json, dumps_json_line
+from config import NEWS_API_KEY, ALPACA_API_KEY, ALPACA_SECRET_KEY, LOOKBACK_PERIOD_HISTORY, BAR_GRANULARITY, BASE_URL, ALPACA_MAX_CONCURRENT_REQUESTS
 
-NEWS_JSON_PATH = os.path.join("data", "alpaca_realtime_news.json")
+NEWS_JSON_PATH = os.path.join("data", "alpaca_realtime_news.json")  # Legacy format: one JSON array, rewritten per item
+NEWS_JSONL_PATH = os.path.join("data", "alpaca_realtime_news.jsonl")  # One news item per line, append-only
+NEWS_BUFFER_SIZE = 1000  # Most recent news items kept in memory by the websocket client
+NEWS_WRITE_QUEUE_SIZE = 10_000  # News items waiting to be written to disk
+NEWS_WRITE_BATCH_SIZE = 64  # Max news items per file write
+NEWS_WRITE_INTERVAL_SECONDS = 0.25  # Max time a news item waits for its batch to fill
+
+# Alpaca bars use lowercase OHLCV names; match the yfinance columns the rest of the pipeline expects
+_ALPACA_BAR_COLUMNS = {"open": "Open", "high": "High", "low": "Low", "close": "Close", "volume": "Volume"}
+
+def _save_history(df, symbol):
+    """
+    Saves raw bar history to data/, as zstd-compressed Parquet when pyarrow is available, else CSV.
+    Skips the write when the last bar and row count match the stamp left by the previous save.
+    """
+    path = f"data/{symbol}_history.parquet" if pyarrow is not None else f"data/{symbol}_history.csv"
+    stamp_path = f"data/{symbol}_history.stamp"
+    stamp = f"{df.index[-1]}|{len(df)}"
+    try:
+        with open(stamp_path) as f:
+            if f.read() == stamp and os.path.exists(path):
+                return
+    except OSError:
+        pass
+    if pyarrow is not None:
+        df.to_parquet(path, compression="zstd")
+    else:
+        df.to_csv(path)
+    with open(stamp_path, "w") as f:
+        f.write(stamp)
+
+def save_processed_history(df, symbol):
+    """Saves a history with indicators to data/, as zstd-compressed Parquet when pyarrow is available, else CSV."""
+    if pyarrow is not None:
+        df.to_parquet(f"data/{symbol}_processed_history.parquet", compression="zstd")
+    else:
+        df.to_csv(f"data/{symbol}_processed_history.csv")
+
+# Caps concurrent Alpaca data requests across all threads calling get_historical_trade_data
+_alpaca_semaphore = threading.Semaphore(ALPACA_MAX_CONCURRENT_REQUESTS)
+
+@lru_cache(maxsize=1)
+def _get_alpaca_api():
+    """
+    Returns the process-wide Alpaca REST client, so its HTTP session (and keep-alive connections) is reused
+    across symbols and cycles. Created on first use because construction fails without credentials.
+    """
+    import alpaca_trade_api as tradeapi
+    return tradeapi.REST(ALPACA_API_KEY, ALPACA_SECRET_KEY, base_url=BASE_URL, api_version='v2')
+
+# Fetched bars are reused until the next bar window opens: (symbol, period, bar window index) -> DataFrame
+_BAR_SECONDS = pd.Timedelta(BAR_GRANULARITY).total_seconds()
+_bars_cache = {}
+_bars_cache_lock = threading.Lock()
 
 def get_historical_trade_data(symbol, period=LOOKBACK_PERIOD_HISTORY, save_json=False):
+    """
+    Fetches historical data using Alpaca API for intraday bars, or yfinance for stocks if Alpaca not available.
+    Results are cached per bar window, so repeated calls within a cycle don't refetch. save_json always fetches.
+    """
+    bucket = int(time.time() // _BAR_SECONDS)
+    key = (symbol, period, bucket)
+    if not save_json:
+        with _bars_cache_lock:
+            cached = _bars_cache.get(key)
+        if cached is not None:
+            return cached.copy()  # Callers such as calculate_indicators modify the frame in place
+    df = _fetch_historical_trade_data(symbol, period=period, save_json=save_json)
+    if not df.empty:  # Don't cache failed fetches
+        with _bars_cache_lock:
+            for stale_key in [k for k in _bars_cache if k[2] != bucket]:
+                del _bars_cache[stale_key]
+            _bars_cache[key] = df.copy()
+    return df
+
+def _fetch_historical_trade_data(symbol, period=LOOKBACK_PERIOD_HISTORY, save_json=False):
     """Fetches historical data using Alpaca API for intraday bars, or yfinance for stocks if Alpaca not available."""
     try:
-        api = tradeapi.REST(ALPACA_API_KEY, ALPACA_SECRET_KEY, base_url=BASE_URL, api_version='v2')
+        api = _get_alpaca_api()
         # Use Alpaca for both stocks and crypto if possible
-        bars = api.get_bars(symbol, BAR_GRANULARITY, limit=None, start=None, end=None, adjustment=None, feed='iex')
+        with _alpaca_semaphore:
+            bars = api.get_bars(symbol, BAR_GRANULARITY, limit=None, start=None, end=None, adjustment=None, feed='iex')
         df = bars.df
         if not df.empty:
-            df = df[df['symbol'] == symbol]
-            df = df.copy()
-            df.index = pd.to_datetime(df.index)
-            df.sort_index(inplace=True)
-            df.to_csv(f"data/{symbol}_history.csv")
+            # The boolean filter and rename each return a new frame, so no separate copy() is needed
+            df = df[df['symbol'] == symbol].rename(columns=_ALPACA_BAR_COLUMNS)
+            # Alpaca normally returns a UTC DatetimeIndex already; only parse when it doesn't
+            if not isinstance(df.index, pd.DatetimeIndex):
+                df.index = pd.to_datetime(df.index, utc=True, cache=True)
+            if not df.index.is_monotonic_increasing:
+                df = df.sort_index()
+            _save_history(df, symbol)
             if save_json:
-                json_path = f"data/{symbol}_history.json"
-                df.reset_index(inplace=True)
-                df_dict = df.to_dict(orient="records")
-                with open(json_path, "w") as f:
-                    json.dump(df_dict, f, indent=2, default=str)
+                # reset_index copies, so the returned frame keeps its DatetimeIndex
+                write_json(f"data/{symbol}_history.json", df.reset_index().to_dict(orient="records"), default=str)
             return df
         else:
             print(f"No intraday data found for {symbol} using Alpaca.")
@@ -36,17 +121,15 @@ def get_historical_trade_data(symbol, period=LOOKBACK_PERIOD_HISTORY, save_json=
         print(f"Error fetching intraday data for {symbol} from Alpaca: {e}")
         # Fallback to yfinance (daily bars only)
         try:
+            import yfinance as yf
             stock = yf.Ticker(symbol)
             data = stock.history(period=period)
             if not data.empty:
                 print(f"Fetched {len(data)} rows for {symbol} over {period} (daily bars, fallback).")
-                data.to_csv(f"data/{symbol}_history.csv")
+                _save_history(data, symbol)
                 if save_json:
-                    json_path = f"data/{symbol}_history.json"
-                    data.reset_index(inplace=True)
-                    data_dict = data.to_dict(orient="records")
-                    with open(json_path, "w") as f:
-                        json.dump(data_dict, f, indent=2, default=str)
+                    # reset_index copies, so the returned frame keeps its DatetimeIndex
+                    write_json(f"data/{symbol}_history.json", data.reset_index().to_dict(orient="records"), default=str)
                 return data
             else:
                 print(f"No data found for {symbol} over {period}.")
@@ -55,22 +138,84 @@ def get_historical_trade_data(symbol, period=LOOKBACK_PERIOD_HISTORY, save_json=
             print(f"Error fetching data for {symbol} from yfinance: {e2}")
             return pd.DataFrame()
 
+def get_historical_trade_data_many(symbols, period=LOOKBACK_PERIOD_HISTORY, max_workers=ALPACA_MAX_CONCURRENT_REQUESTS):
+    """Fetches historical data for several symbols concurrently. Returns a dict of symbol -> DataFrame."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(symbols, executor.map(lambda symbol: get_historical_trade_data(symbol, period=period), symbols)))
+
+@lru_cache(maxsize=1)
+def _news_client():
+    """Returns the process-wide NewsAPI client, with its own requests.Session so successive queries reuse connections."""
+    import requests
+    from newsapi import NewsApiClient
+    return NewsApiClient(api_key=NEWS_API_KEY, session=requests.Session())
+
+def get_financial_news(query, page_size=10):
+    """Fetches the latest NewsAPI articles matching query. Returns a DataFrame with title, description, source, created_at and url."""
+    try:
+        response = _news_client().get_everything(q=query, language="en", sort_by="publishedAt", page_size=page_size)
+    except Exception as e:
+        print(f"Error fetching news for '{query}' from NewsAPI: {e}")
+        return pd.DataFrame()
+    articles = response.get("articles", [])
+    return pd.DataFrame({
+        "title": [a.get("title") for a in articles],
+        "description": [a.get("description") for a in articles],
+        "source": [(a.get("source") or {}).get("name") for a in articles],
+        "created_at": [a.get("publishedAt") for a in articles],
+        "url": [a.get("url") for a in articles],
+    })
+
+def get_financial_news_batch(symbols, page_size_per_symbol=5):
+    """
+    Fetches news for several symbols with one NewsAPI OR query, then buckets articles per symbol
+    by case-insensitive match on the symbol root (BTC-USD -> BTC) in title or description.
+    Returns a dict of symbol -> DataFrame (same columns as get_financial_news).
+    """
+    roots = {symbol: symbol.split('-')[0] for symbol in symbols}
+    query = " OR ".join(f'"{root}"' for root in dict.fromkeys(roots.values()))
+    # NewsAPI caps page_size at 100
+    news = get_financial_news(query, page_size=min(100, page_size_per_symbol * len(symbols)))
+    if news.empty:
+        return {symbol: news for symbol in symbols}
+    text = (news["title"].fillna("") + " " + news["description"].fillna("")).str.lower()
+    return {
+        symbol: news[text.str.contains(root.lower(), regex=False)].head(page_size_per_symbol).reset_index(drop=True)
+        for symbol, root in roots.items()
+    }
+
 class AlpacaNewsWebSocket:
     def __init__(self, url="wss://stream.data.alpaca.markets/v1beta1/news"):
         self.api_key = ALPACA_API_KEY
         self.secret_key = ALPACA_SECRET_KEY
         self.url = url
-        self.news_buffer = []
+        self.news_buffer = deque(maxlen=NEWS_BUFFER_SIZE)  # Older items are dropped; everything is still persisted to disk
         self.ws = None
         self.connected = False
+        self._news_fp = None  # Opened on the first saved item
+        self._write_q = asyncio.Queue(maxsize=NEWS_WRITE_QUEUE_SIZE)
 
     async def connect(self):
-        async with websockets.connect(self.url) as websocket:
-            self.ws = websocket
-            await self.authenticate()
-            await self.subscribe_news()
-            self.connected = True
-            await self.listen()
+        # Disk writes happen in a separate task so listen() never waits on the file system
+        writer = asyncio.create_task(self._news_writer())
+        try:
+            import websockets
+            async with websockets.connect(self.url) as websocket:
+                self.ws = websocket
+                await self.authenticate()
+                await self.subscribe_news()
+                self.connected = True
+                await self.listen()
+        finally:
+            writer.cancel()
+            # Let the writer finish its in-flight and partial batches first, so the JSONL keeps arrival order
+            with contextlib.suppress(asyncio.CancelledError):
+                await writer
+            # Flush anything the writer had not picked up yet
+            pending = []
+            while not self._write_q.empty():
+                pending.append(self._write_q.get_nowait())
+            self._write_news_lines(pending)
 
     async def authenticate(self):
         auth_msg = {
@@ -89,23 +234,50 @@ class AlpacaNewsWebSocket:
         print(f"Alpaca News WebSocket Subscribe Response: {response}")
 
     def save_news_to_json(self, news_item):
-        """Append a news item to the persistent JSON file."""
+        """Append a news item as one line to the persistent JSONL file."""
+        self._write_news_lines([news_item])
+
+    def _write_news_lines(self, news_items):
+        """Appends news items to the JSONL file with a single write."""
+        if not news_items:
+            return
         try:
-            if not os.path.exists(NEWS_JSON_PATH):
-                with open(NEWS_JSON_PATH, "w") as f:
-                    json.dump([], f)
-            with open(NEWS_JSON_PATH, "r+") as f:
-                try:
-                    news_list = json.load(f)
-                except json.JSONDecodeError:
-                    news_list = []
-                news_list.append(news_item)
-                f.seek(0)
-                json.dump(news_list, f, indent=2)
-                f.truncate()
+            if self._news_fp is None:
+                os.makedirs(os.path.dirname(NEWS_JSONL_PATH), exist_ok=True)
+                self._news_fp = open(NEWS_JSONL_PATH, "ab")
+            self._news_fp.write(b"".join(dumps_json_line(item) + b"\n" for item in news_items))
+            self._news_fp.flush()
         except Exception as e:
             print(f"Error saving news to JSON: {e}")
 
+    async def _news_writer(self):
+        """Drains the write queue in batches of up to NEWS_WRITE_BATCH_SIZE items or NEWS_WRITE_INTERVAL_SECONDS."""
+        loop = asyncio.get_running_loop()
+        batch = []
+        write = None  # The batch currently being written on a worker thread
+        try:
+            while True:
+                batch = [await self._write_q.get()]
+                deadline = loop.time() + NEWS_WRITE_INTERVAL_SECONDS
+                while len(batch) < NEWS_WRITE_BATCH_SIZE:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._write_q.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                # Hand the batch off before awaiting, so a cancel never writes it a second time
+                batch, to_write = [], batch
+                write = asyncio.ensure_future(asyncio.to_thread(self._write_news_lines, to_write))
+                await asyncio.shield(write)
+                write = None
+        except asyncio.CancelledError:
+            if write is not None:
+                await write  # The worker thread keeps writing after a cancel; wait so writes never overlap
+            self._write_news_lines(batch)  # Don't lose a batch that was still filling up
+            raise
+
     async def listen(self):
         print("Listening for real-time Alpaca news...")
         while True:
@@ -122,14 +294,18 @@ class AlpacaNewsWebSocket:
                             "id": item.get("id")
                         }
                         self.news_buffer.append(news_item)
-                        self.save_news_to_json(news_item)
+                        try:
+                            self._write_q.put_nowait(news_item)
+                        except asyncio.QueueFull:
+                            print("News write queue is full; writing item synchronously.")
+                            self.save_news_to_json(news_item)
                         print(f"[NEWS] {news_item['created_at']} {news_item['headline']}")
             except Exception as e:
                 print(f"WebSocket error: {e}")
                 break
 
     def get_latest_news(self, limit=10):
-        return self.news_buffer[-limit:]
+        return list(islice(self.news_buffer, max(0, len(self.news_buffer) - limit), None))
 
     
 alpaca_news_ws = AlpacaNewsWebSocket()
@@ -140,14 +316,31 @@ def start_alpaca_news_ws_background(loop):
 def get_latest_alpaca_news(limit=10):
     return alpaca_news_ws.get_latest_news(limit=limit)
 
+# (limit, file mtime, file size) -> parsed news items from the last load_news_from_json read
+_news_cache = {"key": None, "items": []}
+
 def load_news_from_json(limit=10):
+    """
+    Returns the last `limit` saved news items, parsing only those lines. The result is reused until the
+    JSONL file's size or modification time changes.
+    """
     try:
-        if not os.path.exists(NEWS_JSON_PATH):
-            print(f"No news JSON file found at {NEWS_JSON_PATH}. Returning empty list.")
+        try:
+            st = os.stat(NEWS_JSONL_PATH)
+        except OSError:
+            if os.path.exists(NEWS_JSON_PATH):  # Fall back to a file written by the old JSON-array format
+                with open(NEWS_JSON_PATH, "r") as f:
+                    return json.load(f)[-limit:]
+            print(f"No news JSON file found at {NEWS_JSONL_PATH}. Returning empty list.")
             return []
-        with open(NEWS_JSON_PATH, "r") as f:
-            news_list = json.load(f)
-            return news_list[-limit:]
+        key = (limit, st.st_mtime_ns, st.st_size)
+        if _news_cache["key"] == key:
+            return list(_news_cache["items"])
+        with open(NEWS_JSONL_PATH, "rb") as f:
+            lines = deque(f, maxlen=limit)
+        items = [json.loads(line) for line in lines if line.strip()]
+        _news_cache.update(key=key, items=items)
+        return list(items)
     except Exception as e:
         print(f"Error loading news from JSON: {e}")
         return []
@@ -159,20 +352,17 @@ if __name__ == "__main__":
     # Test with a few symbols
     symbols = ["BTC-USD"]  # Add more as needed
 
-    for symbol in symbols:
-        get_historical_trade_data(symbol, period="3mo") # Fetch 3 months of data
+    get_historical_trade_data_many(symbols, period="3mo") # Fetch 3 months of data
     print(f"Historical trade data collection complete for {symbols}.")
 
-    # Start Alpaca News WebSocket in the background and keep running
-    loop = asyncio.get_event_loop()
-    news_task = start_alpaca_news_ws_background(loop)
+    # Run the Alpaca News WebSocket until interrupted
     try:
-        loop.run_forever()
+        import uvloop  # Optional, faster event loop for the websocket
+        uvloop.install()
+    except ImportError:
+        pass
+    try:
+        asyncio.run(alpaca_news_ws.connect())
     except KeyboardInterrupt:
-        print("\nShutting down Alpaca News WebSocket...")
-        news_task.cancel()
-        try:
-            loop.run_until_complete(news_task)
-        except:
-            pass
-        loop.close()
\ No newline at end of file
+        # asyncio.run cancels the task, which flushes any queued news to disk
+        print("\nShutting down Alpaca News WebSocket...")
\ No newline at end of file
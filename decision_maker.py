@@ -1,12 +1,79 @@
+import sys
+from dataclasses import dataclass, fields
+import numpy as np
 # Import the new position_sizer module
 from position_sizer import calculate_position_size
 # Assuming you already import portfolio_manager if needed for portfolio_value/cash_available
 
+@dataclass
+class PortfolioView:
+    """
+    Column (struct-of-arrays) view of a portfolio state dict: per-symbol qty / price / value arrays
+    aligned through a shared symbol -> index table. Build it once per cycle (and again after trades)
+    instead of walking the nested holdings / current_prices dicts for every decision.
+    """
+    symbols: list
+    idx: dict
+    qty: np.ndarray
+    price: np.ndarray
+    value: np.ndarray
+    cash: float
+    portfolio_value: float
+
+    @classmethod
+    def from_portfolio(cls, portfolio):
+        holdings = portfolio.get('holdings', {})
+        prices = portfolio.get('current_prices', {})
+        symbols = [sys.intern(s) for s in dict.fromkeys([*holdings, *prices])]
+        qty = np.array([holdings.get(s, {}).get('qty', 0) for s in symbols], dtype=np.float64)
+        price = np.array([prices.get(s, 0) for s in symbols], dtype=np.float64)
+        return cls(
+            symbols=symbols,
+            idx={s: i for i, s in enumerate(symbols)},
+            qty=qty,
+            price=price,
+            value=qty * price,
+            cash=portfolio['cash'],
+            portfolio_value=portfolio.get('portfolio_value', portfolio['cash']), # Use actual portfolio value
+        )
+
+@dataclass(slots=True, frozen=True)
+class RiskSettings:
+    """
+    Typed, read-only snapshot of a RISK_SETTINGS dict, built once per cycle so decisions read plain
+    attributes instead of repeated dict.get() calls. Defaults match the fallbacks the dict readers used.
+    get() keeps it usable wherever a risk_settings dict is expected (e.g. calculate_position_size).
+    """
+    min_sentiment_for_buy: float = 40
+    min_sentiment_for_sell: float = -40
+    max_risk_per_trade_percent: float = 0.01
+    max_position_per_asset_percent: float = 0.05
+    min_sentiment_for_size_increase: float = 50
+    sentiment_sizing_factor: float = 0.005
+    atr_stop_multiplier: float = 2.0
+    fallback_size_if_no_risk_defined: float = 0
+    current_holding_qty: float = 0
+
+    @classmethod
+    def from_dict(cls, settings):
+        if isinstance(settings, cls):
+            return settings
+        return cls(**{name: settings[name] for name in _RISK_SETTING_FIELDS if name in settings})
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+_RISK_SETTING_FIELDS = tuple(f.name for f in fields(RiskSettings))
+
+# int8 action codes for the batched decision path
+HOLD_CODE, BUY_CODE, SELL_CODE = 0, 1, 2
+ACTION_CODES = {"HOLD": HOLD_CODE, "BUY": BUY_CODE, "SELL": SELL_CODE}
+
 def make_trading_decision(
     symbol: str,
     llm_analysis_result: dict,
-    current_portfolio: dict, # Contains 'cash', 'portfolio_value', 'current_prices'
-    risk_settings: dict,
+    current_portfolio, # PortfolioView, or a dict with 'cash', 'portfolio_value', 'holdings', 'current_prices'
+    risk_settings, # RiskSettings, or a RISK_SETTINGS dict
     # You will need to pass ATR here if you want to use it for sizing
     # For now, let's assume you'll get ATR from your indicators for the stock
     # If ATR is not available, stop_loss_price must be provided or it will return 0
@@ -20,9 +87,19 @@ def make_trading_decision(
     llm_action = llm_analysis_result.get('action', 'HOLD')
     reasoning = llm_analysis_result.get('reasoning', 'No specific reason provided by LLM.')
     
-    current_price = current_portfolio['current_prices'].get(symbol, 0)
-    portfolio_value = current_portfolio.get('portfolio_value', current_portfolio['cash']) # Use actual portfolio value
-    cash_available = current_portfolio['cash']
+    if isinstance(current_portfolio, PortfolioView):
+        pv = current_portfolio
+        i = pv.idx.get(symbol, -1)
+        current_price = pv.price[i] if i >= 0 else 0.0
+        current_holding_qty = pv.qty[i] if i >= 0 else 0.0
+        portfolio_value = pv.portfolio_value
+        cash_available = pv.cash
+    else:
+        # A plain dict is read directly; building a PortfolioView for one symbol would cost more than the lookups
+        current_price = current_portfolio.get('current_prices', {}).get(symbol, 0)
+        current_holding_qty = current_portfolio.get('holdings', {}).get(symbol, {}).get('qty', 0)
+        cash_available = current_portfolio['cash']
+        portfolio_value = current_portfolio.get('portfolio_value', cash_available) # Use actual portfolio value
 
     # Default to HOLD
     final_decision = "HOLD"
@@ -30,14 +107,14 @@ def make_trading_decision(
     decision_reason = "No compelling reason to trade or outside risk parameters."
 
     # Get risk thresholds from settings
-    min_sentiment_for_buy = risk_settings.get('min_sentiment_for_buy', 40)
-    min_sentiment_for_sell = risk_settings.get('min_sentiment_for_sell', -40)
-    max_risk_per_trade_percent = risk_settings.get('max_risk_per_trade_percent', 0.01) # Use the new name
-    max_position_per_asset_percent = risk_settings.get('max_position_per_asset_percent', 0.05) # Use the new name
+    risk_settings = RiskSettings.from_dict(risk_settings)
+    min_sentiment_for_buy = risk_settings.min_sentiment_for_buy
+    min_sentiment_for_sell = risk_settings.min_sentiment_for_sell
+    max_risk_per_trade_percent = risk_settings.max_risk_per_trade_percent
+    max_position_per_asset_percent = risk_settings.max_position_per_asset_percent
 
     # --- Decision Logic ---
     if llm_action == "BUY" and sentiment > min_sentiment_for_buy:
-        current_holding_qty = current_portfolio['holdings'].get(symbol, {}).get('qty', 0)
         current_holding_value = current_holding_qty * current_price
         if current_holding_value / portfolio_value < max_position_per_asset_percent:
             # Use ATR if provided, else fallback to a default stop loss
@@ -62,7 +139,6 @@ def make_trading_decision(
             decision_reason = f"LLM recommended BUY, but already at max position ({max_position_per_asset_percent:.2%}) for {symbol}."
 
     elif llm_action == "SELL" and sentiment < min_sentiment_for_sell:
-        current_holding_qty = current_portfolio['holdings'].get(symbol, {}).get('qty', 0)
         if current_holding_qty > 0:
             final_decision = "SELL"
             trade_size = current_holding_qty
@@ -96,6 +172,73 @@ def make_trading_decision(
         "llm_reasoning": reasoning
     }
 
+def make_trading_decisions_batch(
+    symbols: list,
+    sentiments: np.ndarray,
+    actions: np.ndarray, # int8 ACTION_CODES
+    prices: np.ndarray,
+    qtys: np.ndarray,
+    pv, # PortfolioView, or a dict with 'cash' and 'portfolio_value'
+    risk_settings, # RiskSettings, or a RISK_SETTINGS dict
+    atr_values: np.ndarray = None
+):
+    """
+    Vectorized make_trading_decision over aligned per-symbol arrays. The threshold and position-limit
+    checks run as NumPy masks; calculate_position_size is only called for the symbols that pass them.
+    Returns (decisions: int8 ACTION_CODES, sizes: int64), without the per-symbol reason strings.
+    """
+    sentiments = np.asarray(sentiments, dtype=np.float64)
+    actions = np.asarray(actions, dtype=np.int8)
+    prices = np.asarray(prices, dtype=np.float64)
+    qtys = np.asarray(qtys, dtype=np.float64)
+
+    if isinstance(pv, PortfolioView):
+        portfolio_value, cash_available = pv.portfolio_value, pv.cash
+    else:  # Only the two totals are needed, so a dict is not converted into a PortfolioView
+        cash_available = pv['cash']
+        portfolio_value = pv.get('portfolio_value', cash_available)
+
+    risk_settings = RiskSettings.from_dict(risk_settings)
+    min_sentiment_for_buy = risk_settings.min_sentiment_for_buy
+    min_sentiment_for_sell = risk_settings.min_sentiment_for_sell
+    max_risk_per_trade_percent = risk_settings.max_risk_per_trade_percent
+    max_position_per_asset_percent = risk_settings.max_position_per_asset_percent
+
+    decisions = np.full(len(symbols), HOLD_CODE, dtype=np.int8)
+    sizes = np.zeros(len(symbols), dtype=np.int64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        under_limit = (qtys * prices) / portfolio_value < max_position_per_asset_percent
+    buy_mask = (actions == BUY_CODE) & (sentiments > min_sentiment_for_buy) & under_limit
+    sell_mask = (actions == SELL_CODE) & (sentiments < min_sentiment_for_sell)
+    close_mask = sell_mask & (qtys > 0)
+    short_mask = sell_mask & (qtys == 0)
+
+    # Closing an existing long needs no sizing
+    decisions[close_mask] = SELL_CODE
+    sizes[close_mask] = qtys[close_mask].astype(np.int64)
+
+    # Sizing stays scalar, but only for the candidates
+    for i in np.flatnonzero(buy_mask | short_mask):
+        trade_type = "BUY" if buy_mask[i] else "SELL"
+        stop_offset = max_risk_per_trade_percent * 2
+        stop_loss_price = prices[i] * (1 - stop_offset if trade_type == "BUY" else 1 + stop_offset)
+        shares = calculate_position_size(
+            portfolio_value=portfolio_value,
+            cash_available=cash_available,
+            asset_price=prices[i],
+            trade_type=trade_type,
+            risk_settings=risk_settings,
+            llm_sentiment_score=sentiments[i],
+            stop_loss_price=stop_loss_price,
+            atr=atr_values[i] if atr_values is not None else None
+        )
+        if shares > 0:
+            decisions[i] = ACTION_CODES[trade_type]
+            sizes[i] = int(shares)
+
+    return decisions, sizes
+
 if __name__ == "__main__":
     # Mock LLM analysis result for testing
     mock_llm_result_buy = {
@@ -162,4 +305,22 @@ if __name__ == "__main__":
         current_portfolio=mock_portfolio,
         risk_settings=mock_risk_settings
     )
-    print(f"GOOGL Decision: {hold_decision}")
\ No newline at end of file
+    print(f"GOOGL Decision: {hold_decision}")
+
+    # Same three scenarios through the batched path
+    batch_symbols = ["MSFT", "AAPL", "GOOGL"]
+    batch_results = [mock_llm_result_buy, mock_llm_result_sell, mock_llm_result_hold]
+    pv = PortfolioView.from_portfolio(mock_portfolio)
+    idx = [pv.idx.get(s, -1) for s in batch_symbols]
+    decisions, sizes = make_trading_decisions_batch(
+        batch_symbols,
+        sentiments=np.array([r["sentiment"] for r in batch_results]),
+        actions=np.array([ACTION_CODES[r["action"]] for r in batch_results], dtype=np.int8),
+        prices=np.array([pv.price[i] if i >= 0 else 0.0 for i in idx]),
+        qtys=np.array([pv.qty[i] if i >= 0 else 0.0 for i in idx]),
+        pv=pv,
+        risk_settings=mock_risk_settings
+    )
+    code_names = {code: name for name, code in ACTION_CODES.items()}
+    for symbol, decision, size in zip(batch_symbols, decisions, sizes):
+        print(f"Batch {symbol} Decision: {code_names[decision]} {size}")
\ No newline at end of file
@@ -1,13 +1,117 @@
 import pandas as pd
+import numpy as np
 import json
 import os
 import datetime
-from portfolio_manager import load_experience_log # Import the new function
-
-def get_market_state_snapshot(history_df, symbol):
+from portfolio_manager import load_experience_log_by_symbol, load_experience_index, EXPERIENCE_LOG_FILE # Import the new function
+from indicators_nb import njit  # None when numba is not installed (indicators_nb also sets up NUMBA_CACHE_DIR)
+
+# MACD signal states as int8 codes. Snapshots store both the string and its code (MACD_signal_code);
+# the similarity filter compares codes. -1 marks a missing or unknown signal.
+MACD_SIG = {"neutral": 0, "bullish": 1, "bearish": 2, "bullish_cross": 3, "bearish_cross": 4}
+
+# Per-symbol column arrays built from the experience log, rebuilt only when the log file changes
+_experience_arrays = {}
+# Parsed JSON log and its symbol -> row indices map, shared by all symbols when the Parquet index is unavailable
+_json_experience = {"key": None}
+
+def _as_float(value):
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+def _macd_code(state):
+    """MACD signal code of a market_state dict; older records only have the string."""
+    code = state.get('MACD_signal_code')
+    if code is None or pd.isna(code):
+        return MACD_SIG.get(state.get('MACD_signal'), -1)
+    return int(code)
+
+def _index_to_records(index_df):
+    """Turns rows of the Parquet experience index into the record shape used by analyze_similar_outcomes."""
+    records = []
+    for row in index_df.itertuples(index=False):
+        pl = row.trade_outcome_pl
+        records.append({
+            "symbol": row.symbol,
+            "market_state": {
+                "RSI": row.RSI,
+                "MACD_signal": row.MACD_signal,
+                "MACD_signal_code": getattr(row, "MACD_signal_code", None),
+                "price_change_5d": row.price_change_5d,
+            },
+            "action_taken": row.action_taken,
+            "trade_outcome_pl": None if pd.isna(pl) else pl,
+            "record_index": row.record_index,
+        })
+    return records
+
+def _load_experience_arrays(symbol):
+    """
+    Returns one symbol's experience records as column arrays (records, rsi, price_change_5d, macd codes).
+    Reads the Parquet index when it is current, else the JSON log. Cached until the log file's size or
+    modification time changes.
+    """
+    try:
+        st = os.stat(EXPERIENCE_LOG_FILE)
+        key = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        key = None
+    cached = _experience_arrays.get(symbol)
+    if cached is not None and key is not None and cached["key"] == key:
+        return cached
+    index_df = load_experience_index(symbol)
+    if index_df is not None:
+        records = _index_to_records(index_df)
+    else:
+        if key is None or _json_experience["key"] != key:
+            records, by_symbol = load_experience_log_by_symbol()
+            _json_experience.update(key=key, records=records, by_symbol=by_symbol)
+        all_records = _json_experience["records"]
+        records = [all_records[i] for i in _json_experience["by_symbol"].get(symbol, ())]
+    states = [record.get('market_state') or {} for record in records]
+    rsi = np.array([_as_float(state.get('RSI')) for state in states], dtype=np.float64)
+    macd = np.array([_macd_code(state) for state in states], dtype=np.int8)
+    # Rows sorted by (MACD code, RSI): a query binary-searches its code's RSI band instead of scanning every row
+    order = np.lexsort((rsi, macd))
+    cached = {
+        "key": key,
+        "records": records,
+        "rsi": rsi,
+        "price_change_5d": np.array([_as_float(state.get('price_change_5d')) for state in states], dtype=np.float64),
+        "macd": macd,
+        "order": order,
+        "macd_sorted": macd[order],
+        "rsi_sorted": rsi[order],
+    }
+    _experience_arrays[symbol] = cached
+    return cached
+
+def _classify_macd(m0, s0, m1, s1):
+    """MACD state from the previous (m0, s0) and latest (m1, s1) MACD / signal values."""
+    if m1 > s1 and m0 <= s0:
+        return "bullish_cross" # MACD line just crossed above signal line
+    if m1 < s1 and m0 >= s0:
+        return "bearish_cross" # MACD line just crossed below signal line
+    if m1 > s1:
+        return "bullish"
+    if m1 < s1:
+        return "bearish"
+    return "neutral"
+
+# Columns the snapshot reads; callers can fetch them once with column_arrays() and share the arrays
+SNAPSHOT_COLUMNS = ('Close', 'RSI', 'MACD', 'MACD_Signal')
+
+def column_arrays(history_df, columns=SNAPSHOT_COLUMNS):
+    """Maps each present column name to its underlying NumPy array (no per-row Series or scalar boxing)."""
+    return {col: history_df[col].values for col in columns if col in history_df.columns}
+
+def get_market_state_snapshot(history_df, symbol, arrays=None):
     """
     Creates a snapshot of the current market state using key indicators.
     This is what we'll use to compare for 'similarity'.
+    arrays: optional column_arrays(history_df) result, when the caller already extracted them.
     """
     if history_df.empty:
         return {}
@@ -16,94 +120,149 @@ def get_market_state_snapshot(history_df, symbol):
     # Assuming history_df already has indicators from the 'indicators.py' step
     # If not, you'd call calculate_indicators(history_df) here.
 
-    latest_data = history_df.iloc[-1] # Get the very last row (most recent data)
+    if arrays is None:
+        arrays = column_arrays(history_df)
+    close_arr = arrays['Close']
+    latest_close = float(close_arr[-1])
 
     # Extract key indicators. You can customize which ones are most relevant.
     # For simplicity, we'll use RSI and MACD signal.
     # You might also want to include recent price change (e.g., 1-day, 5-day % change)
     
-    # Check if MACD columns exist before accessing
-    macd_line = latest_data.get('MACD')
-    signal_line = latest_data.get('MACD_Signal')
-    
+    # Check if MACD columns exist before accessing; read the last two rows straight from the arrays
     macd_signal = "neutral"
-    if macd_line is not None and signal_line is not None:
-        if macd_line > signal_line and history_df['MACD'].iloc[-2] <= history_df['MACD_Signal'].iloc[-2]:
-            macd_signal = "bullish_cross" # MACD line just crossed above signal line
-        elif macd_line < signal_line and history_df['MACD'].iloc[-2] >= history_df['MACD_Signal'].iloc[-2]:
-            macd_signal = "bearish_cross" # MACD line just crossed below signal line
-        elif macd_line > signal_line:
-            macd_signal = "bullish"
-        elif macd_line < signal_line:
-            macd_signal = "bearish"
-
-    # Calculate recent price change
-    if len(history_df) >= 5:
-        price_change_5d = (latest_data['Close'] - history_df['Close'].iloc[-5]) / history_df['Close'].iloc[-5]
+    if 'MACD' in arrays and 'MACD_Signal' in arrays:
+        macd_arr = arrays['MACD']
+        sig_arr = arrays['MACD_Signal']
+        m1, s1 = macd_arr[-1], sig_arr[-1]
+        if len(close_arr) >= 2:
+            m0, s0 = macd_arr[-2], sig_arr[-2]
+        else:
+            m0 = s0 = float('nan')  # No previous bar, so no crossover
+        macd_signal = _classify_macd(m0, s0, m1, s1)
+
+    # Calculate recent price change in plain float arithmetic
+    if close_arr.size >= 5:
+        close_5 = float(close_arr[-5])
+        price_change_5d = (latest_close - close_5) / close_5
     else:
         price_change_5d = 0.0
 
     snapshot = {
         "symbol": symbol,
-        "current_price": latest_data['Close'],
-        "RSI": latest_data.get('RSI'),
+        "current_price": latest_close,
+        "RSI": arrays['RSI'][-1] if 'RSI' in arrays else None,
         "MACD_signal": macd_signal,
+        "MACD_signal_code": MACD_SIG[macd_signal],
         "price_change_5d": price_change_5d, # Percentage change over 5 days
         # Add other indicators you deem important for defining 'similarity'
         # e.g., 'SMA_20_cross_SMA_50': 'bullish_cross' / 'bearish_cross' / 'no_cross'
     }
     return snapshot
 
+def get_market_state_snapshot_from_row(latest, symbol):
+    """
+    Same snapshot as get_market_state_snapshot, built from the dict returned by
+    indicators.IncrementalIndicators.update() instead of a full history DataFrame.
+    """
+    if not latest:
+        return {}
+    macd_signal = _classify_macd(latest['MACD_prev'], latest['MACD_Signal_prev'], latest['MACD'], latest['MACD_Signal'])
+    return {
+        "symbol": symbol,
+        "current_price": latest['Close'],
+        "RSI": latest['RSI'],
+        "MACD_signal": macd_signal,
+        "MACD_signal_code": MACD_SIG[macd_signal],
+        "price_change_5d": latest['price_change_5d'],
+    }
+
+def _rsi_band_candidates(arrays, macd_code, rsi, tolerance):
+    """
+    Row indices, in log order, that share macd_code and whose RSI can be within the relative tolerance of rsi.
+    For rsi > 0 and tolerance < 1 that band is [rsi * (1 - tolerance), rsi / (1 - tolerance)]; other inputs
+    fall back to every row with the code. Callers still apply the exact comparison to the result.
+    """
+    macd_sorted = arrays["macd_sorted"]
+    start = np.searchsorted(macd_sorted, macd_code, side='left')
+    stop = np.searchsorted(macd_sorted, macd_code, side='right')
+    if 1e-6 < rsi and 0 <= tolerance < 1:
+        rsi_sorted = arrays["rsi_sorted"][start:stop]
+        # Widened slightly so float rounding at the edges never drops a match
+        lo = np.searchsorted(rsi_sorted, rsi * (1 - tolerance) * (1 - 1e-9), side='left')
+        hi = np.searchsorted(rsi_sorted, rsi / (1 - tolerance) * (1 + 1e-9), side='right')
+        start, stop = start + lo, start + hi
+    return np.sort(arrays["order"][start:stop])
+
 def find_similar_experiences(current_market_state, tolerance=0.15, max_results=5):
     """
     Finds past experience records that match similar market conditions.
     Similarity is based on a few key indicators within a 'tolerance' percentage.
+    When read from the Parquet index, records carry only the indexed fields (symbol, market_state
+    RSI / MACD_signal / price_change_5d, action_taken, trade_outcome_pl) plus their record_index in the JSON log.
     """
-    experience_log = load_experience_log()
-    similar_records = []
-
-    if not current_market_state or not experience_log:
+    if not current_market_state:
         return []
-
     current_rsi = current_market_state.get('RSI')
     current_macd_signal = current_market_state.get('MACD_signal')
+    current_macd_code = _macd_code(current_market_state)
     current_price_change_5d = current_market_state.get('price_change_5d')
     current_symbol = current_market_state.get('symbol')
 
-    if current_rsi is None or current_macd_signal is None or current_price_change_5d is None:
+    if current_rsi is None or current_macd_signal is None or current_price_change_5d is None or current_symbol is None:
         print("Warning: Current market state is incomplete for similarity search.")
         return []
 
-    for record in experience_log:
-        past_state = record.get('market_state', {})
-        past_rsi = past_state.get('RSI')
-        past_macd_signal = past_state.get('MACD_signal')
-        past_price_change_5d = past_state.get('price_change_5d')
-        past_symbol = record.get('symbol')
-
-        if past_rsi is None or past_macd_signal is None or past_price_change_5d is None:
-            continue # Skip incomplete past records
-
-        # Check for similar RSI (within tolerance percentage)
-        rsi_diff = abs(current_rsi - past_rsi) / max(current_rsi, past_rsi, 1e-6) # Avoid division by zero
-        is_rsi_similar = rsi_diff <= tolerance
-
-        # Check for similar MACD signal (exact match for simplicity)
-        is_macd_similar = (current_macd_signal == past_macd_signal)
-
-        # Check for similar 5-day price change (within tolerance percentage)
-        price_change_diff = abs(current_price_change_5d - past_price_change_5d) / max(abs(current_price_change_5d), abs(past_price_change_5d), 1e-6)
-        is_price_change_similar = price_change_diff <= tolerance
+    # Only the current symbol's records are loaded (predicate pushdown on the Parquet index)
+    arrays = _load_experience_arrays(current_symbol)
+    if not arrays["records"]:
+        return []
 
-        # Combine similarity checks. You can adjust the weighting or add more checks.
-        if is_rsi_similar and is_macd_similar and is_price_change_similar and past_symbol == current_symbol:
-            similar_records.append(record)
-            if len(similar_records) >= max_results:
-                break # Stop if we found enough similar records
+    if current_macd_code < 0:
+        return []  # An unknown current signal matches nothing
+    candidates = _rsi_band_candidates(arrays, current_macd_code, current_rsi, tolerance)
+
+    # Records with missing fields hold NaN / -1 and never pass the comparisons below
+    rsi_arr = arrays["rsi"][candidates]
+    pchg_arr = arrays["price_change_5d"][candidates]
+
+    # Similar RSI (within tolerance percentage)
+    rsi_diff = np.abs(rsi_arr - current_rsi) / np.maximum(np.maximum(rsi_arr, current_rsi), 1e-6) # Avoid division by zero
+    # Similar 5-day price change (within tolerance percentage)
+    pchg_diff = np.abs(pchg_arr - current_price_change_5d) / np.maximum(np.maximum(np.abs(pchg_arr), abs(current_price_change_5d)), 1e-6)
+    # Same MACD signal (exact int8 code match)
+    mask = (
+        (rsi_diff <= tolerance)
+        & (pchg_diff <= tolerance)
+        & (arrays["macd"][candidates] == current_macd_code)
+    )
+    records = arrays["records"]
+    similar_records = [records[i] for i in candidates[mask][:max_results]]
 
     print(f"Found {len(similar_records)} similar past experiences for {current_market_state['symbol']}.")
     return similar_records
 
+def _aggregate_outcomes(pl, act, n_actions):
+    """Counts wins / losses per action code and sums P&L, skipping NaN (not yet realized) outcomes."""
+    wins = np.zeros(n_actions, np.int64)
+    losses = np.zeros(n_actions, np.int64)
+    total = 0.0
+    count = 0
+    for i in range(pl.shape[0]):
+        p = pl[i]
+        if np.isnan(p):
+            continue
+        total += p
+        count += 1
+        if p > 0:
+            wins[act[i]] += 1
+        elif p < 0:
+            losses[act[i]] += 1
+    return wins, losses, total, count
+
+if njit is not None:
+    _aggregate_outcomes = njit(cache=True)(_aggregate_outcomes)
+
 def analyze_similar_outcomes(similar_experiences):
     """
     Analyzes the outcomes of similar past experiences to provide learning insights.
@@ -112,25 +271,14 @@ def analyze_similar_outcomes(similar_experiences):
     if not similar_experiences:
         return "No similar past experiences to learn from."
 
-    successful_actions = {} # Count of actions that led to profit
-    unsuccessful_actions = {} # Count of actions that led to loss
-    total_pl = 0.0
-    num_trades = 0
-
-    for record in similar_experiences:
-        action = record['action_taken']
-        pl = record['trade_outcome_pl']
-        
-        if pl is None: # Skip records where P&L isn't available yet
-            continue
-
-        num_trades += 1
-        total_pl += pl
+    # Encode actions as int8 codes (in order of first appearance) and P&L as float64, NaN where not available yet
+    action_codes = {}
+    act = np.array([action_codes.setdefault(record['action_taken'], len(action_codes)) for record in similar_experiences], dtype=np.int8)
+    pl = np.array([np.nan if record['trade_outcome_pl'] is None else record['trade_outcome_pl'] for record in similar_experiences], dtype=np.float64)
+    wins, losses, total_pl, num_trades = _aggregate_outcomes(pl, act, len(action_codes))
 
-        if pl > 0:
-            successful_actions[action] = successful_actions.get(action, 0) + 1
-        elif pl < 0:
-            unsuccessful_actions[action] = unsuccessful_actions.get(action, 0) + 1
+    successful_actions = {action: int(wins[code]) for action, code in action_codes.items() if wins[code]} # Count of actions that led to profit
+    unsuccessful_actions = {action: int(losses[code]) for action, code in action_codes.items() if losses[code]} # Count of actions that led to loss
 
     insight = "Based on similar past market conditions:\n"
     if num_trades > 0:
@@ -1,9 +1,59 @@
+import hashlib
+import logging
+import numpy as np
 import pandas as pd
 import pandas_ta as ta
+from collections import OrderedDict, deque
 from data_collector import get_historical_trade_data
+from indicators_nb import compute_all, KERNEL_COLUMNS, KERNEL_COLUMN_NAMES
+
+logger = logging.getLogger(__name__)
+
+INDICATOR_CACHE_SIZE = 64
+_indicator_cache = OrderedDict()  # (symbol, last bar timestamp, row count, OHLCV digest) -> DataFrame with indicators
+_DIGEST_COLUMNS = ("Open", "High", "Low", "Close", "Volume")
+
+def _ohlcv_digest(data):
+    """16-byte blake2b digest of the OHLCV values, so a revised bar under an unchanged timestamp misses the cache."""
+    frame = data[[col for col in _DIGEST_COLUMNS if col in data.columns]]
+    try:
+        buffer = np.ascontiguousarray(frame.to_numpy(dtype=np.float64)).tobytes()
+    except (TypeError, ValueError):  # Non-numeric cells: hash the values pandas-side instead
+        buffer = pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes()
+    return hashlib.blake2b(buffer, digest_size=16).digest()
+
+def _kernel_indicators(data):
+    """Runs the fused indicators_nb kernel and returns its columns, skipping any whose OHLCV inputs are missing."""
+    n = len(data)
+    inputs = {
+        # np.array copies: pandas copy-on-write hands out read-only views, which the kernel signature rejects
+        col: np.array(data[col], dtype=np.float64) if col in data.columns else np.full(n, np.nan)
+        for col in ("Close", "High", "Low", "Volume")
+    }
+    out = np.empty((n, len(KERNEL_COLUMN_NAMES)))
+    compute_all(inputs["Close"], inputs["High"], inputs["Low"], inputs["Volume"], out)
+    keep = [j for j, (_, needs) in enumerate(KERNEL_COLUMNS) if all(col in data.columns for col in needs)]
+    return pd.DataFrame(out[:, keep], index=data.index, columns=[KERNEL_COLUMN_NAMES[j] for j in keep])
+
+def _named(series, name):
+    return series.rename(name) if series is not None else None
+
+# (name for error messages, function of the cleaned OHLCV frame returning a DataFrame or Series), in output
+# column order. The fused kernel covers the single-column indicators (SMA, RSI, ATR, ...); the rest
+# come from pandas_ta.
+_INDICATOR_TABLE = [
+    ("Fused indicator kernel", _kernel_indicators),
+    ("CCI", lambda d: _named(ta.cci(d['High'], d['Low'], d['Close'], length=20), 'CCI')),
+    ("MACD", lambda d: ta.macd(d['Close'])),
+    ("Bollinger Bands", lambda d: ta.bbands(d['Close'])),
+    ("Stochastic Oscillator", lambda d: ta.stoch(d['High'], d['Low'], d['Close'])),
+    ("Parabolic SAR", lambda d: _named(ta.psar(d['High'], d['Low'], d['Close'])['PSARl_0.02_0.2'], 'PSAR')),
+    ("EOM", lambda d: ta.eom(d['High'], d['Low'], d['Close'], d['Volume'])),
+    ("Ultimate Oscillator", lambda d: _named(ta.uo(d['High'], d['Low'], d['Close'], length=7), 'UO')),
+]
 
 def calculate_indicators(data):
-    """Calculates common technical indicators using pandas_ta."""
+    """Calculates common technical indicators with the fused kernel and pandas_ta."""
     if data.empty:
         print("Error: DataFrame is empty. Cannot calculate indicators.")
         return data
@@ -23,7 +73,7 @@ def calculate_indicators(data):
     # Ensure index is DatetimeIndex, monotonic, unique, and sorted
     if not isinstance(data.index, pd.DatetimeIndex):
         try:
-            data.index = pd.to_datetime(data.index)
+            data.index = pd.to_datetime(data.index, cache=True)
         except Exception as e:
             print(f"Index conversion to DatetimeIndex failed: {e}")
             return data
@@ -32,124 +82,179 @@ def calculate_indicators(data):
     if not data.index.is_unique:
         data = data[~data.index.duplicated(keep='first')]
 
-    # Print debug info for index and Close column
-    print(f"Index type: {type(data.index)} | Monotonic: {data.index.is_monotonic_increasing} | Unique: {data.index.is_unique}")
-    print(f"Close dtype: {data['Close'].dtype} | NaNs: {data['Close'].isnull().sum()} | Rows: {len(data)}")
+    # Debug info for index and Close column (the f-strings are only built when DEBUG logging is on)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Index type: {type(data.index)} | Monotonic: {data.index.is_monotonic_increasing} | Unique: {data.index.is_unique}")
+        logger.debug(f"Close dtype: {data['Close'].dtype} | NaNs: {data['Close'].isnull().sum()} | Rows: {len(data)}")
 
-    # Add Moving Averages
-    try:
-        data['SMA_20'] = ta.sma(data['Close'], length=20)
-    except Exception as e:
-        print(f"SMA_20 calculation failed: {e}")
-    try:
-        data['SMA_50'] = ta.sma(data['Close'], length=50)
-    except Exception as e:
-        print(f"SMA_50 calculation failed: {e}")
+    # Every indicator frame or series is collected here and joined in one concat at the end
+    extra_frames = []
+    for name, compute in _INDICATOR_TABLE:
+        try:
+            result = compute(data)
+            if result is not None and not result.empty:
+                extra_frames.append(result)
+        except Exception as e:
+            print(f"{name} calculation failed: {e}")
 
-    # Add Relative Strength Index (RSI)
-    try:
-        data['RSI'] = ta.rsi(data['Close'], length=14)
-    except Exception as e:
-        print(f"RSI calculation failed: {e}")
+    if extra_frames:
+        data = pd.concat([data, *extra_frames], axis=1)
 
-    # Add Moving Average Convergence Divergence (MACD)
-    try:
-        macd = ta.macd(data['Close'])
-        if macd is not None and not macd.empty:
-            data = pd.concat([data, macd], axis=1)
-    except Exception as e:
-        print(f"MACD calculation failed: {e}")
+    logger.info("Calculated additional indicators for %d rows.", len(data))
+    return data
 
-    # Add Bollinger Bands
-    try:
-        bbands = ta.bbands(data['Close'])
-        if bbands is not None and not bbands.empty:
-            data = pd.concat([data, bbands], axis=1)
-    except Exception as e:
-        print(f"Bollinger Bands calculation failed: {e}")
+def calculate_indicators_cached(symbol, data):
+    """
+    Same as calculate_indicators, but memoized per (symbol, last bar timestamp, OHLCV content) so the
+    analysis and reflection paths share one computation per cycle. A new or revised bar changes the key.
+    """
+    if data is None or data.empty:
+        return data
+    key = (symbol, data.index[-1], len(data), _ohlcv_digest(data))
+    cached = _indicator_cache.get(key)
+    if cached is not None:
+        _indicator_cache.move_to_end(key)
+        return cached
+    result = calculate_indicators(data)
+    _indicator_cache[key] = result
+    if len(_indicator_cache) > INDICATOR_CACHE_SIZE:
+        _indicator_cache.popitem(last=False)
+    return result
 
-    # Add Stochastic Oscillator
-    try:
-        stoch = ta.stoch(data['High'], data['Low'], data['Close'])
-        if stoch is not None and not stoch.empty:
-            data = pd.concat([data, stoch], axis=1)
-    except Exception as e:
-        print(f"Stochastic Oscillator calculation failed: {e}")
+class _EMA:
+    """Exponential moving average seeded with the SMA of its first `length` values, as pandas_ta does."""
+    __slots__ = ("length", "alpha", "count", "total", "value")
 
-    # Add Average True Range (ATR)
-    try:
-        data['ATR'] = ta.atr(data['High'], data['Low'], data['Close'], length=14)
-    except Exception as e:
-        print(f"ATR calculation failed: {e}")
+    def __init__(self, length):
+        self.length = length
+        self.alpha = 2.0 / (length + 1)
+        self.count = 0
+        self.total = 0.0
+        self.value = np.nan
 
-    # Add Commodity Channel Index (CCI)
-    try:
-        data['CCI'] = ta.cci(data['High'], data['Low'], data['Close'], length=20)
-    except Exception as e:
-        print(f"CCI calculation failed: {e}")
+    def update(self, x):
+        self.count += 1
+        if self.count < self.length:
+            self.total += x
+        elif self.count == self.length:
+            self.value = (self.total + x) / self.length
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
 
-    # Add Williams %R
-    try:
-        data['WILLR'] = ta.willr(data['High'], data['Low'], data['Close'], length=14)
-    except Exception as e:
-        print(f"Williams %R calculation failed: {e}")
+class IncrementalIndicators:
+    """
+    Per-symbol rolling indicator state for live bars: update() folds in one new bar in O(1) and returns
+    the latest values, instead of recomputing calculate_indicators over the whole history every tick.
+    Covers SMA_20, SMA_50, RSI, ATR, ROC, OBV, ADL and MACD (12/26/9) with the same definitions as the
+    fused kernel / pandas_ta, plus the inputs get_market_state_snapshot_from_row needs
+    (previous MACD / signal and price_change_5d).
+    """
 
-    # Add Money Flow Index (MFI)
-    try:
-        data['MFI'] = ta.mfi(data['High'], data['Low'], data['Close'], data['Volume'], length=14)
-    except Exception as e:
-        print(f"MFI calculation failed: {e}")
+    def __init__(self):
+        self.sma20 = deque(maxlen=20)
+        self.sma50 = deque(maxlen=50)
+        self.sma20_sum = 0.0
+        self.sma50_sum = 0.0
+        self.closes = deque(maxlen=11)  # Enough for ROC(10) and the 5-bar price change
+        self.prev_close = np.nan
+        self.rsi_up = np.nan
+        self.rsi_down = np.nan
+        self.atr = np.nan
+        self.tr_count = 0
+        self.tr_sum = 0.0
+        self.obv = np.nan
+        self.adl = 0.0
+        self.ema_fast = _EMA(12)
+        self.ema_slow = _EMA(26)
+        self.ema_signal = _EMA(9)
+        self.macd = np.nan
+        self.macd_signal = np.nan
+        self.latest = {}
 
-    # Add Rate of Change (ROC)
-    try:
-        data['ROC'] = ta.roc(data['Close'], length=10)
-    except Exception as e:
-        print(f"ROC calculation failed: {e}")
+    @classmethod
+    def from_history(cls, history_df):
+        """Seeds the state by replaying an OHLCV history once; later bars then go through update()."""
+        state = cls()
+        cols = [np.array(history_df[c], dtype=np.float64) for c in ("High", "Low", "Close", "Volume")]
+        for high, low, close, volume in zip(*cols):
+            state.update(high, low, close, volume)
+        return state
 
-    # Add Parabolic SAR
-    try:
-        data['PSAR'] = ta.psar(data['High'], data['Low'], data['Close'])['PSARl_0.02_0.2']
-    except Exception as e:
-        print(f"Parabolic SAR calculation failed: {e}")
+    @staticmethod
+    def _push(window, total, x):
+        if len(window) == window.maxlen:
+            total -= window[0]
+        window.append(x)
+        return total + x
 
-    # Add On-Balance Volume (OBV)
-    try:
-        data['OBV'] = ta.obv(data['Close'], data['Volume'])
-    except Exception as e:
-        print(f"OBV calculation failed: {e}")
+    def update(self, high, low, close, volume):
+        """Adds one bar and returns a dict with the latest indicator values (NaN during warm-up)."""
+        prev_close = self.prev_close
+        self.sma20_sum = self._push(self.sma20, self.sma20_sum, close)
+        self.sma50_sum = self._push(self.sma50, self.sma50_sum, close)
+        self.closes.append(close)
 
-    # Add Chaikin Money Flow (CMF)
-    try:
-        data['CMF'] = ta.cmf(data['High'], data['Low'], data['Close'], data['Volume'], length=20)
-    except Exception as e:
-        print(f"CMF calculation failed: {e}")
+        # RSI: Wilder-smoothed average gain / loss, seeded by the first change
+        rsi = np.nan
+        if not np.isnan(prev_close):
+            d = close - prev_close
+            up, down = max(d, 0.0), max(-d, 0.0)
+            if np.isnan(self.rsi_up):
+                self.rsi_up, self.rsi_down = up, down
+            else:
+                self.rsi_up += (up - self.rsi_up) / 14.0
+                self.rsi_down += (down - self.rsi_down) / 14.0
+            if self.rsi_up + self.rsi_down != 0.0:
+                rsi = 100.0 * self.rsi_up / (self.rsi_up + self.rsi_down)
 
-    # Add Ease of Movement (EOM)
-    try:
-        eom = ta.eom(data['High'], data['Low'], data['Close'], data['Volume'])
-        if eom is not None and not eom.empty:
-            data = pd.concat([data, eom], axis=1)
-    except Exception as e:
-        print(f"EOM calculation failed: {e}")
+        # ATR: mean of the first 14 true ranges, then Wilder smoothing
+        hl = high - low
+        tr = hl if np.isnan(prev_close) else max(abs(hl), abs(high - prev_close), abs(prev_close - low))
+        self.tr_count += 1
+        if self.tr_count < 14:
+            self.tr_sum += tr
+        elif self.tr_count == 14:
+            self.atr = (self.tr_sum + tr) / 14.0
+        else:
+            self.atr += (tr - self.atr) / 14.0
 
-    # Add Accumulation/Distribution Line (ADL)
-    try:
-        data['ADL'] = ta.ad(data['High'], data['Low'], data['Close'], data['Volume'])
-    except Exception as e:
-        print(f"ADL calculation failed: {e}")
+        # OBV (undefined on the first bar) and the Accumulation/Distribution line
+        if not np.isnan(prev_close):
+            self.obv = 0.0 if np.isnan(self.obv) else self.obv
+            self.obv += volume if close > prev_close else -volume if close < prev_close else 0.0
+        self.adl += ((2.0 * close - high - low) / hl) * volume if hl != 0.0 else 0.0
 
-    # Add Ultimate Oscillator (UO)
-    try:
-        data['UO'] = ta.uo(data['High'], data['Low'], data['Close'], length=7)
-    except Exception as e:
-        print(f"Ultimate Oscillator calculation failed: {e}")
+        # MACD: EMA(12) - EMA(26), signal EMA(9) over the MACD line once it exists
+        prev_macd, prev_signal = self.macd, self.macd_signal
+        fast = self.ema_fast.update(close)
+        slow = self.ema_slow.update(close)
+        self.macd = fast - slow
+        if not np.isnan(self.macd):
+            self.macd_signal = self.ema_signal.update(self.macd)
 
-    print(f"Calculated additional indicators for {len(data)} rows.")
-    return data
+        closes = self.closes
+        self.prev_close = close
+        self.latest = {
+            "Close": close,
+            "SMA_20": self.sma20_sum / 20.0 if len(self.sma20) == 20 else np.nan,
+            "SMA_50": self.sma50_sum / 50.0 if len(self.sma50) == 50 else np.nan,
+            "RSI": rsi,
+            "ATR": self.atr,
+            "ROC": 100.0 * (close - closes[0]) / closes[0] if len(closes) == 11 and closes[0] != 0.0 else np.nan,
+            "OBV": self.obv,
+            "ADL": self.adl,
+            "MACD": self.macd,
+            "MACD_Signal": self.macd_signal,
+            "MACD_prev": prev_macd,
+            "MACD_Signal_prev": prev_signal,
+            "price_change_5d": (close - closes[-5]) / closes[-5] if len(closes) >= 5 else 0.0,
+        }
+        return self.latest
 
 if __name__ == "__main__":
     # Example usage: Load historical data and calculate indicators
-    # Assume 'data/AAPL_history.csv' exists from Step 2
+    # Assume 'data/AAPL_history.parquet' (or .csv without pyarrow) exists from Step 2
     try:
         symbols = ["AAPL", "BTC-USD"]
         for symbol in symbols:
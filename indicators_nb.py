@@ -0,0 +1,184 @@
+import os
+import numpy as np
+
+# Compiled kernels are cached on disk; NUMBA_CACHE_DIR overrides the location (it must be set before numba is imported)
+os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".numba_cache"))
+try:
+    from numba import njit
+except ImportError:  # numba is optional (newer pandas_ta installs it); the kernel then runs as plain Python
+    njit = None
+
+# Output columns of the fused kernel, in order. Each entry lists the OHLCV inputs it needs.
+KERNEL_COLUMNS = [
+    ("SMA_20", ("Close",)),
+    ("SMA_50", ("Close",)),
+    ("RSI", ("Close",)),
+    ("ATR", ("High", "Low", "Close")),
+    ("WILLR", ("High", "Low", "Close")),
+    ("MFI", ("High", "Low", "Close", "Volume")),
+    ("ROC", ("Close",)),
+    ("OBV", ("Close", "Volume")),
+    ("CMF", ("High", "Low", "Close", "Volume")),
+    ("ADL", ("High", "Low", "Close", "Volume")),
+]
+KERNEL_COLUMN_NAMES = [name for name, _ in KERNEL_COLUMNS]
+
+# The compiled kernel computes the SMAs in its single pass; the plain-Python fallback fills them with
+# _sma_np instead. numba freezes this global as a compile-time constant.
+_FUSED_SMA = njit is not None
+
+
+def _window_mean(x, i, length):
+    total = 0.0
+    for j in range(i - length + 1, i + 1):
+        total += x[j]
+    return total / length
+
+
+def _sma_np(close, length):
+    """Rolling mean via one cumulative sum (close must be NaN-free, as calculate_indicators ensures)."""
+    c = np.cumsum(np.insert(close, 0, 0.0))
+    out = np.full(close.size, np.nan)
+    if close.size >= length:
+        out[length - 1:] = (c[length:] - c[:-length]) / length
+    return out
+
+
+def _compute_all_loop(close, high, low, volume, out):
+    """
+    Fills out[:, j] with the KERNEL_COLUMNS indicators in one pass over the bars.
+    Definitions follow pandas_ta: SMA, RSI(14) and ATR(14) with Wilder smoothing, WILLR(14), MFI(14),
+    ROC(10), OBV, CMF(20) and the Accumulation/Distribution line. Warm-up rows are NaN.
+    """
+    n = close.shape[0]
+    out[:, :] = np.nan
+    if n == 0:
+        return
+    rsi_alpha = 1.0 / 14.0
+    atr_alpha = 1.0 / 14.0
+    rsi_up = np.nan
+    rsi_down = np.nan
+    atr = np.nan
+    tr_sum = 0.0
+    obv = 0.0
+    adl = 0.0
+    tp = np.empty(n)
+    tr = np.empty(n)
+    mfv = np.empty(n)  # Money flow volume, shared by CMF and ADL
+    for i in range(n):
+        c = close[i]
+        h = high[i]
+        lo = low[i]
+        v = volume[i]
+        tp[i] = (h + lo + c) / 3.0
+        hl = h - lo
+        mfv[i] = ((2.0 * c - h - lo) / hl) * v if hl != 0.0 else 0.0
+
+        # SMA_20 / SMA_50
+        if _FUSED_SMA:
+            if i >= 19:
+                out[i, 0] = _window_mean(close, i, 20)
+            if i >= 49:
+                out[i, 1] = _window_mean(close, i, 50)
+
+        # RSI: Wilder-smoothed average gain / loss, seeded by the first change
+        if i >= 1:
+            d = c - close[i - 1]
+            if not np.isnan(d):
+                up = d if d > 0.0 else 0.0
+                down = -d if d < 0.0 else 0.0
+                if np.isnan(rsi_up):
+                    rsi_up = up
+                    rsi_down = down
+                else:
+                    rsi_up = (1.0 - rsi_alpha) * rsi_up + rsi_alpha * up
+                    rsi_down = (1.0 - rsi_alpha) * rsi_down + rsi_alpha * down
+            total = rsi_up + rsi_down
+            if total != 0.0:
+                out[i, 2] = 100.0 * rsi_up / total
+
+        # ATR: true range, seeded with the mean of the first 14, then Wilder smoothing
+        if i == 0:
+            tr[i] = hl
+        else:
+            pc = close[i - 1]
+            tr[i] = max(abs(hl), abs(h - pc), abs(pc - lo))
+        if i < 14:
+            tr_sum += tr[i]
+            if i == 13:
+                atr = tr_sum / 14.0
+                out[i, 3] = atr
+        else:
+            atr = (1.0 - atr_alpha) * atr + atr_alpha * tr[i]
+            out[i, 3] = atr
+
+        # Williams %R
+        if i >= 13:
+            hh = high[i - 13]
+            ll = low[i - 13]
+            for j in range(i - 12, i + 1):
+                hh = max(hh, high[j])
+                ll = min(ll, low[j])
+            if hh != ll:
+                out[i, 4] = 100.0 * ((c - ll) / (hh - ll) - 1.0)
+
+        # MFI: money flow split by whether the typical price rose or fell
+        if i >= 14:
+            pos = 0.0
+            neg = 0.0
+            for j in range(i - 13, i + 1):
+                # As in pandas_ta, an unchanged typical price counts as a down move
+                flow = tp[j] * volume[j] if tp[j] > tp[j - 1] else -tp[j] * volume[j]
+                if flow > 0.0:
+                    pos += flow
+                else:
+                    neg -= flow
+            if pos + neg != 0.0:
+                out[i, 5] = 100.0 * pos / (pos + neg)
+
+        # ROC
+        if i >= 10 and close[i - 10] != 0.0:
+            out[i, 6] = 100.0 * (c - close[i - 10]) / close[i - 10]
+
+        # OBV: running volume signed by the close-to-close direction (undefined on the first bar)
+        if i >= 1:
+            if c > close[i - 1]:
+                obv += v
+            elif c < close[i - 1]:
+                obv -= v
+            out[i, 7] = obv
+
+        # CMF
+        if i >= 19:
+            vol_sum = 0.0
+            mfv_sum = 0.0
+            for j in range(i - 19, i + 1):
+                vol_sum += volume[j]
+                mfv_sum += mfv[j]
+            if vol_sum != 0.0:
+                out[i, 8] = mfv_sum / vol_sum
+
+        # Accumulation/Distribution line
+        adl += mfv[i]
+        out[i, 9] = adl
+
+
+# Explicit signatures compile (or load from the cache) at declaration time, so dtype drift never triggers a recompile.
+# No fastmath: the kernel relies on NaN checks, which fastmath lets numba optimize away.
+KERNEL_SIGNATURE = "void(float64[:], float64[:], float64[:], float64[:], float64[:, :])"
+if njit is not None:
+    _window_mean = njit("float64(float64[:], int64, int64)", cache=True)(_window_mean)
+    compute_all = njit(KERNEL_SIGNATURE, cache=True)(_compute_all_loop)
+else:
+    def compute_all(close, high, low, volume, out):
+        _compute_all_loop(close, high, low, volume, out)
+        out[:, 0] = _sma_np(close, 20)
+        out[:, 1] = _sma_np(close, 50)
+
+def _warmup(rows=100):
+    """Runs the kernel once on dummy data at import so per-symbol calls only pay dispatch cost."""
+    prices = np.linspace(100.0, 110.0, rows)
+    compute_all(prices, prices + 1.0, prices - 1.0, np.full(rows, 1000.0), np.empty((rows, len(KERNEL_COLUMN_NAMES))))
+
+if njit is not None:
+    _warmup()
@@ -1,8 +1,81 @@
+import hashlib
+import io
 import json
 import re
-from portfolio_manager import load_experience_log, load_portfolio_state, save_portfolio_state
-from config import RISK_SETTINGS, RISK_MANAGEMENT_VARS
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+import numpy as np
+from portfolio_manager import load_experience_log, load_portfolio_state, log_anomaly, maybe_flush_portfolio_state
+from config import RISK_SETTINGS, RISK_MANAGEMENT_VARS, LOG_ADAPTATION_SUMMARY
 from datetime import datetime
+from indicators_nb import njit  # None when numba is not installed
+try:
+    import orjson
+except ImportError:  # orjson is optional; reflections are then decoded with the stdlib json module only
+    orjson = None
+
+_json_decoder = json.JSONDecoder()
+
+# Share of a max_risk_per_trade_percent change that is applied during a drawdown, indexed by the number of
+# consecutive negative adaptation impacts // _DRAWDOWN_STREAK_STEP: 0-9 the full step (slowdown starts at 10
+# negative impacts, as it always has), 10-14 half of it, 15 or more a quarter
+_DRAWDOWN_ALPHA = (1.0, 1.0, 0.5, 0.25)
+_DRAWDOWN_STREAK_STEP = 5
+
+# (param, default it decays toward, low extreme, high extreme) for the parameters checked for decay and for being stuck
+_DECAY_TARGETS = tuple(
+    (param, default_val, min(0.01, default_val), max(0.10, default_val))
+    for param, default_val in (
+        ('max_risk_per_trade_percent', 0.05),
+        ('min_sentiment_for_buy', 40),
+        ('max_position_per_asset_percent', 0.05),
+    )
+)
+
+@lru_cache(maxsize=64)
+def _coercer(param):
+    """Type of a RISK_SETTINGS value, used to coerce the LLM's suggestion for it."""
+    return type(RISK_SETTINGS[param])
+
+@lru_cache(maxsize=64)
+def _llm_param_range(param):
+    """Allowed (min, max) for a parameter the LLM may tune, or None if it may not."""
+    spec = RISK_MANAGEMENT_VARS.get(param)
+    if spec is None or not spec.get('use_in_llm', False):
+        return None
+    return spec['range']
+
+def _check_anomalies(vals, pls):
+    """
+    Numeric anomaly checks over a series of adaptation impacts (parameter values and their avg_pl).
+    Returns (volatile, oscillating, stuck_negative): a swing above 0.05 within the last 5 values, the last
+    5 values alternating direction, and the last 10 values all equal with a negative summed avg_pl.
+    """
+    n = vals.shape[0]
+    volatile = False
+    oscillating = False
+    stuck_negative = False
+    if n >= 5:
+        oscillating = True
+        for i in range(n - 4, n):
+            step = vals[i] - vals[i - 1]
+            if abs(step) > 0.05:
+                volatile = True
+            if i >= n - 3 and step * (vals[i - 1] - vals[i - 2]) >= 0:
+                oscillating = False
+    if n >= 10:
+        stuck_negative = True
+        total = 0.0
+        for i in range(n - 10, n):
+            if vals[i] != vals[n - 10]:
+                stuck_negative = False
+            total += pls[i]
+        stuck_negative = stuck_negative and total < 0
+    return volatile, oscillating, stuck_negative
+
+if njit is not None:
+    _check_anomalies = njit("UniTuple(boolean, 3)(float64[:], float64[:])", cache=True)(_check_anomalies)
 
 def analyze_llm_reflections():
     """
@@ -10,6 +83,8 @@ def analyze_llm_reflections():
     Also logs every adaptation, checks for anomalies, and logs LLM reasoning for transparency.
     Now also adapts stop-loss/take-profit, cooldown, and position sizing rules.
     """
+    # One timestamp for everything this call logs
+    ts = datetime.now().isoformat()
     state = load_portfolio_state()
     reflections = state.get('llm_reflection_log', [])
     exp_log = load_experience_log()
@@ -19,319 +94,383 @@ def analyze_llm_reflections():
 
     # Use a moving window of 20 trades for adaptation
     window = 20
-    last_trades = [r for r in exp_log if r.get('trade_outcome_pl') is not None][-window:]
+    # Walk back from the newest record so only about `window` records are visited, not the whole log
+    last_trades = list(islice((r for r in reversed(exp_log) if r.get('trade_outcome_pl') is not None), window))[::-1]
     if not last_trades:
         print("Not enough trades for adaptation.")
         return None
 
-    avg_pl = sum(r['trade_outcome_pl'] for r in last_trades) / len(last_trades)
-    print(f"Moving average P&L over last {window} trades: {avg_pl:.2f}")
+    force_save = False  # Rollbacks and shadow-test promotions are written immediately, other updates are debounced
+    # param_update entries logged during this cycle (string keys so they survive the JSON round-trip)
+    cycle = state.get('cycle_count', 0)  # Stamped on every adaptation_log entry below
+    cycle_param_updates = state.setdefault('_cycle_param_updates', {}).setdefault(str(cycle), [])
+    al = state.setdefault('adaptation_log', [])  # Local aliases; the lists are only ever mutated in place
+
+    # P&L column of the window, read out of the records once
+    pls = np.fromiter((r['trade_outcome_pl'] for r in last_trades), dtype=np.float64, count=len(last_trades))
+    # Fingerprint only what the adaptation step reads: the P&L window and the last reflection. The log length is left
+    # out on purpose, since main_agent appends an experience record for every symbol on every cycle.
+    input_hash = hashlib.sha256(b"%b|%b" % (pls.tobytes(), reflections[-1].get('llm_reflection', '').encode())).hexdigest()
+    # The same P&L window and reflection as the previous analysis would only repeat its adaptation step, so
+    # that is skipped; the per-cycle bookkeeping (loss cooldown, summary, shadow test) below still runs
+    inputs_changed = input_hash != state.get('_last_input_hash')
+    state['_last_input_hash'] = input_hash
+    risk = state.get('RISK_SETTINGS', dict(RISK_SETTINGS)).get('max_risk_per_trade_percent', RISK_SETTINGS['max_risk_per_trade_percent'])
+    # Track the impact of each adaptation for the last 10 cycles
+    ai = state.setdefault('adaptation_impact', [])
+    if not inputs_changed:
+        print("Trade window and reflection unchanged since the last analysis, keeping current settings.")
+        rs = state.setdefault('RISK_SETTINGS', dict(RISK_SETTINGS))
+        new_risk = risk
+    else:
+        avg_pl = float(pls.mean())
+        print(f"Moving average P&L over last {window} trades: {avg_pl:.2f}")
 
-    # --- LLM Confidence Weighting ---
-    llm_confidence_weight = 1.0
-    llm_confidence_label = 'neutral'
-    if reflections:
-        last_reflection = reflections[-1]
-        reflection_text = last_reflection.get('llm_reflection', '')
-        # --- JSON-based adaptation protocol ---
-        param_suggestions = None
-        try:
-            # Try to extract JSON object from the reflection
-            json_start = reflection_text.find('{')
-            json_end = reflection_text.rfind('}')
-            if json_start != -1 and json_end != -1 and json_end > json_start:
-                json_str = reflection_text[json_start:json_end+1]
-                parsed = json.loads(json_str)
+        # --- LLM Confidence Weighting ---
+        llm_confidence_weight = 1.0
+        llm_confidence_label = 'neutral'
+        if reflections:
+            last_reflection = reflections[-1]
+            reflection_text = last_reflection.get('llm_reflection', '')
+            # --- JSON-based adaptation protocol ---
+            param_suggestions = None
+            try:
+                # Decode the first JSON object embedded in the reflection, trying each '{' in turn
+                parsed = None
+                parse_error = None
+                json_start = reflection_text.find('{')
+                if orjson is not None and json_start != -1:
+                    # Fast path: the reflection holds a single object, so the outermost braces delimit it exactly
+                    try:
+                        parsed = orjson.loads(reflection_text[json_start:reflection_text.rfind('}') + 1])
+                        json_start = -1
+                    except ValueError:
+                        pass
+                while json_start != -1:
+                    try:
+                        parsed, _ = _json_decoder.raw_decode(reflection_text, json_start)
+                        break
+                    except ValueError as e:
+                        parse_error = parse_error or e
+                        json_start = reflection_text.find('{', json_start + 1)
+                if parsed is None and parse_error is not None:
+                    raise parse_error
                 if isinstance(parsed, dict) and 'param_suggestions' in parsed:
                     param_suggestions = parsed['param_suggestions']
-        except Exception as e:
-            state.setdefault('adaptation_log', []).append({
-                'timestamp': datetime.now().isoformat(),
-                'type': 'llm_json_parse_error',
-                'error': str(e),
+            except Exception as e:
+                al.append({
+                    'timestamp': ts,
+                    'cycle': cycle,
+                    'type': 'llm_json_parse_error',
+                    'error': str(e),
+                    'reflection_excerpt': reflection_text[:100]
+                })
+            # If param_suggestions found, apply them with validation
+            if param_suggestions:
+                for param, value in param_suggestions.items():
+                    param_range = _llm_param_range(param)
+                    if param_range is not None:
+                        min_val, max_val = param_range
+                        # Clamp value to allowed range
+                        try:
+                            val = _coercer(param)(value)
+                            val = max(min_val, min(max_val, val))
+                            state['RISK_SETTINGS'][param] = val
+                            update = {
+                                'timestamp': ts,
+                                'cycle': cycle,
+                                'type': 'param_update',
+                                'param': param,
+                                'new_value': val,
+                                'reason': 'LLM JSON param_suggestions',
+                                'reflection_excerpt': str(value)
+                            }
+                            al.append(update)
+                            cycle_param_updates.append(update)
+                            print(f"Adapted {param} to {val} via LLM JSON suggestion.")
+                        except Exception as e:
+                            al.append({
+                                'timestamp': ts,
+                                'cycle': cycle,
+                                'type': 'param_update_error',
+                                'param': param,
+                                'error': str(e),
+                                'reflection_excerpt': str(value)
+                            })
+            # --- Legacy confidence parsing removed; now handled via LLM JSON protocol or can be extended in future ---
+            # Log confidence (if needed, can be set by LLM JSON or other mechanism)
+            al.append({
+                'timestamp': ts,
+                'cycle': cycle,
+                'type': 'llm_confidence',
+                'confidence_label': llm_confidence_label,
+                'confidence_weight': llm_confidence_weight,
                 'reflection_excerpt': reflection_text[:100]
             })
-        # If param_suggestions found, apply them with validation
-        if param_suggestions:
-            for param, value in param_suggestions.items():
-                if param in RISK_MANAGEMENT_VARS and RISK_MANAGEMENT_VARS[param].get('use_in_llm', False):
-                    min_val, max_val = RISK_MANAGEMENT_VARS[param]['range']
-                    # Clamp value to allowed range
-                    try:
-                        val = type(RISK_SETTINGS[param])(value)
-                        val = max(min_val, min(max_val, val))
-                        state['RISK_SETTINGS'][param] = val
-                        state.setdefault('adaptation_log', []).append({
-                            'timestamp': datetime.now().isoformat(),
-                            'type': 'param_update',
-                            'param': param,
-                            'new_value': val,
-                            'reason': 'LLM JSON param_suggestions',
-                            'reflection_excerpt': str(value)
-                        })
-                        print(f"Adapted {param} to {val} via LLM JSON suggestion.")
-                    except Exception as e:
-                        state.setdefault('adaptation_log', []).append({
-                            'timestamp': datetime.now().isoformat(),
-                            'type': 'param_update_error',
-                            'param': param,
-                            'error': str(e),
-                            'reflection_excerpt': str(value)
-                        })
-        # --- Legacy confidence parsing removed; now handled via LLM JSON protocol or can be extended in future ---
-        # Log confidence (if needed, can be set by LLM JSON or other mechanism)
-        state.setdefault('adaptation_log', []).append({
-            'timestamp': datetime.now().isoformat(),
-            'type': 'llm_confidence',
-            'confidence_label': llm_confidence_label,
-            'confidence_weight': llm_confidence_weight,
-            'reflection_excerpt': reflection_text[:100]
-        })
-
-    # --- Use confidence weight in adaptation ---
-    # Adapt risk: increase if profitable, decrease if losing, scaled by LLM confidence
-    risk = state.get('RISK_SETTINGS', dict(RISK_SETTINGS)).get('max_risk_per_trade_percent', RISK_SETTINGS['max_risk_per_trade_percent'])
-    if avg_pl > 0:
-        base_change = min(risk * 0.05, 0.10 - risk)
-        new_risk = min(risk + base_change * llm_confidence_weight, 0.10)  # Cap at 10%
-    else:
-        base_change = max(-risk * 0.05, 0.01 - risk)
-        new_risk = max(risk + base_change * llm_confidence_weight, 0.01)  # Floor at 1%
 
-    # Log adaptation with confidence
-    if 'adaptation_log' not in state:
-        state['adaptation_log'] = []
-    state['adaptation_log'].append({
-        'timestamp': datetime.now().isoformat(),
-        'type': 'param_update',
-        'param': 'max_risk_per_trade_percent',
-        'new_value': new_risk,
-        'reason': f'Performance-based adaptation (LLM confidence: {llm_confidence_label}, weight: {llm_confidence_weight})',
-        'avg_pl': avg_pl
-    })
-    state['RISK_SETTINGS'] = dict(RISK_SETTINGS)
-    state['RISK_SETTINGS']['max_risk_per_trade_percent'] = new_risk
-    print(f"Adapted max_risk_per_trade_percent to {new_risk:.4f} (LLM confidence: {llm_confidence_label}, weight: {llm_confidence_weight})")
+        # --- Use confidence weight in adaptation ---
+        # Adapt risk: increase if profitable, decrease if losing, scaled by LLM confidence
+        if avg_pl > 0:
+            base_change = min(risk * 0.05, 0.10 - risk)
+            new_risk = min(risk + base_change * llm_confidence_weight, 0.10)  # Cap at 10%
+        else:
+            base_change = max(-risk * 0.05, 0.01 - risk)
+            new_risk = max(risk + base_change * llm_confidence_weight, 0.01)  # Floor at 1%
 
-    # Optionally adapt sentiment threshold
-    sentiment = state['RISK_SETTINGS'].get('min_sentiment_for_buy', RISK_SETTINGS['min_sentiment_for_buy'])
-    if avg_pl < 0 and sentiment < 60:
-        state['RISK_SETTINGS']['min_sentiment_for_buy'] = sentiment + 2
-        state['adaptation_log'].append({
-            'timestamp': datetime.now().isoformat(),
+        # Log adaptation with confidence
+        update = {
+            'timestamp': ts,
+            'cycle': cycle,
             'type': 'param_update',
-            'param': 'min_sentiment_for_buy',
-            'new_value': sentiment + 2,
-            'reason': 'Performance-based adaptation',
+            'param': 'max_risk_per_trade_percent',
+            'new_value': new_risk,
+            'reason': f'Performance-based adaptation (LLM confidence: {llm_confidence_label}, weight: {llm_confidence_weight})',
             'avg_pl': avg_pl
-        })
-        print(f"Increased min_sentiment_for_buy to {sentiment + 2}")
+        }
+        al.append(update)
+        cycle_param_updates.append(update)
+        state['RISK_SETTINGS'] = rs = dict(RISK_SETTINGS)
+        rs['max_risk_per_trade_percent'] = new_risk
+        print(f"Adapted max_risk_per_trade_percent to {new_risk:.4f} (LLM confidence: {llm_confidence_label}, weight: {llm_confidence_weight})")
 
-    # --- Anomaly Detection ---
-    # Too many adaptations in last 10 cycles
-    recent_adaptations = [a for a in state['adaptation_log'][-10:] if a['type'] == 'param_update']
-    if len(recent_adaptations) > 5:
-        from portfolio_manager import log_anomaly
-        log_anomaly(state, 'frequent_adaptations', f"{len(recent_adaptations)} parameter changes in last 10 cycles.")
-    # Parameter at min/max
-    if new_risk == 0.01 or new_risk == 0.10:
-        from portfolio_manager import log_anomaly
-        log_anomaly(state, 'risk_param_limit', f"max_risk_per_trade_percent at limit: {new_risk}")
-    # --- Loss Cooldown: If last trade was a loss, set last_loss_cycle ---
-    if last_trades and last_trades[-1]['trade_outcome_pl'] < 0:
-        state['RISK_SETTINGS']['last_loss_cycle'] = state.get('cycle_count', 0)
-    
-    # --- Adaptation Impact Tracking & Rollback ---
-    # Track the impact of each adaptation for the last 10 cycles
-    if 'adaptation_impact' not in state:
-        state['adaptation_impact'] = []
-    # Log the current adaptation and its avg_pl
-    state['adaptation_impact'].append({
-        'timestamp': datetime.now().isoformat(),
-        'cycle': state.get('cycle_count', 0),
-        'param': 'max_risk_per_trade_percent',
-        'value': new_risk,
-        'avg_pl': avg_pl
-    })
-    # Keep only the last 20 for memory efficiency
-    state['adaptation_impact'] = state['adaptation_impact'][-20:]
-    # Rollback logic: if the last 10 adaptations led to negative avg_pl, revert to previous value
-    recent_impacts = [a for a in state['adaptation_impact'] if a['param'] == 'max_risk_per_trade_percent'][-10:]
-    if len(recent_impacts) == 10 and all(a['avg_pl'] < 0 for a in recent_impacts):
-        # Find the last value before these 10
-        prev = [a for a in state['adaptation_impact'][:-10] if a['param'] == 'max_risk_per_trade_percent']
-        if prev:
-            rollback_val = prev[-1]['value']
-            state['RISK_SETTINGS']['max_risk_per_trade_percent'] = rollback_val
-            state['adaptation_log'].append({
-                'timestamp': datetime.now().isoformat(),
-                'type': 'rollback',
-                'param': 'max_risk_per_trade_percent',
-                'rolled_back_to': rollback_val,
-                'reason': '10 consecutive negative avg_pl after adaptation'
-            })
-            print(f"Rolled back max_risk_per_trade_percent to {rollback_val} due to poor performance.")
-    # --- Multi-Parameter Change Detection ---
-    # Detect and log if multiple parameters are changed in a single cycle
-    param_changes_this_cycle = [a for a in state['adaptation_log'] if a.get('timestamp', '').startswith(datetime.now().date().isoformat()) and a['type'] == 'param_update']
-    if len(param_changes_this_cycle) > 1:
-        state['adaptation_log'].append({
-            'timestamp': datetime.now().isoformat(),
-            'type': 'multi_param_update',
-            'params_changed': [a['param'] for a in param_changes_this_cycle],
-            'new_values': {a['param']: a['new_value'] for a in param_changes_this_cycle},
-            'reason': 'Multiple parameter changes in single cycle',
-            'cycle': state.get('cycle_count', 0)
-        })
-        # Track combined impact for later analysis
-        if 'multi_param_impact' not in state:
-            state['multi_param_impact'] = []
-        state['multi_param_impact'].append({
-            'timestamp': datetime.now().isoformat(),
-            'cycle': state.get('cycle_count', 0),
-            'params_changed': [a['param'] for a in param_changes_this_cycle],
-            'new_values': {a['param']: a['new_value'] for a in param_changes_this_cycle},
+        # Optionally adapt sentiment threshold
+        sentiment = rs.get('min_sentiment_for_buy', RISK_SETTINGS['min_sentiment_for_buy'])
+        if avg_pl < 0 and sentiment < 60:
+            rs['min_sentiment_for_buy'] = sentiment + 2
+            update = {
+                'timestamp': ts,
+                'cycle': cycle,
+                'type': 'param_update',
+                'param': 'min_sentiment_for_buy',
+                'new_value': sentiment + 2,
+                'reason': 'Performance-based adaptation',
+                'avg_pl': avg_pl
+            }
+            al.append(update)
+            cycle_param_updates.append(update)
+            print(f"Increased min_sentiment_for_buy to {sentiment + 2}")
+
+        # --- Anomaly Detection ---
+        # One backwards pass over the last 20 log entries serves this check and the stagnation check further down
+        recent_update_count = 0
+        newest_update = None
+        for age, a in enumerate(islice(reversed(al), 20)):
+            if a['type'] == 'param_update':
+                if newest_update is None:
+                    newest_update = a
+                if age < 10:
+                    recent_update_count += 1
+        # Too many adaptations in last 10 cycles
+        if recent_update_count > 5:
+            log_anomaly(state, 'frequent_adaptations', f"{recent_update_count} parameter changes in last 10 cycles.")
+        # Parameter at min/max
+        if new_risk == 0.01 or new_risk == 0.10:
+            log_anomaly(state, 'risk_param_limit', f"max_risk_per_trade_percent at limit: {new_risk}")
+
+        # --- Adaptation Impact Tracking & Rollback ---
+        # Log the current adaptation and its avg_pl
+        ai.append({
+            'timestamp': ts,
+            'cycle': cycle,
+            'param': 'max_risk_per_trade_percent',
+            'value': new_risk,
             'avg_pl': avg_pl
         })
-        state['multi_param_impact'] = state['multi_param_impact'][-20:]
-
-    # --- Adaptive Parameter Decay ---
-    # If a parameter is at its min/max for >10 cycles, decay toward default unless LLM reinforces
-    decay_targets = {
-        'max_risk_per_trade_percent': 0.05,
-        'min_sentiment_for_buy': 40,
-        'max_position_per_asset_percent': 0.05
-    }
-    for param, default_val in decay_targets.items():
-        # Check if at min/max for >10 cycles
-        impacts = [a for a in state.get('adaptation_impact', []) if a['param'] == param]
-        if len(impacts) >= 10:
-            vals = [a['value'] for a in impacts[-10:]]
-            if all(v == min(0.01, default_val) or v == max(0.10, default_val) for v in vals):
-                # Decay toward default by 10% of the distance
-                current_val = state['RISK_SETTINGS'].get(param, default_val)
-                new_val = current_val + 0.1 * (default_val - current_val)
-                # Only decay if LLM hasn't just reinforced the extreme
-                if not any(abs(a['value'] - current_val) < 1e-6 for a in impacts[-3:]):
-                    state['RISK_SETTINGS'][param] = new_val
-                    state['adaptation_log'].append({
-                        'timestamp': datetime.now().isoformat(),
-                        'type': 'param_decay',
-                        'param': param,
-                        'decayed_to': new_val,
-                        'reason': 'Parameter at extreme for >10 cycles, decaying toward default',
-                        'cycle': state.get('cycle_count', 0)
-                    })
-                    print(f"Decayed {param} toward default: {new_val}")
-    # --- Reflection Quality/Consistency Check ---
-    # If LLM suggestions are highly volatile or contradictory over 5 cycles, log anomaly and slow adaptation
-    if len(state.get('adaptation_impact', [])) >= 5:
-        last_vals = [a['value'] for a in state['adaptation_impact'][-5:]]
-        # Volatility: large swings
-        swings = [abs(last_vals[i] - last_vals[i-1]) for i in range(1, 5)]
-        if any(s > 0.05 for s in swings):
-            from portfolio_manager import log_anomaly
-            log_anomaly(state, 'llm_volatility', f"Large parameter swings in last 5 cycles: {swings}")
-            # Optionally slow adaptation (e.g., halve the next change)
-            state['adaptation_log'].append({
-                'timestamp': datetime.now().isoformat(),
-                'type': 'adaptation_slowdown',
-                'reason': 'LLM suggestions volatile, slowing adaptation',
-                'cycle': state.get('cycle_count', 0)
+        # Keep only the last 20 for memory efficiency
+        del ai[:-20]
+        # Per-parameter view of the impacts (built once, not persisted) so the checks below don't rescan the list
+        impact_by_param = {}
+        for a in ai:
+            impact_by_param.setdefault(a['param'], deque(maxlen=20)).append(a)
+        impact_count = len(ai)
+        impact_vals = np.fromiter((a['value'] for a in ai), dtype=np.float64, count=impact_count)
+        impact_pls = np.fromiter((a['avg_pl'] for a in ai), dtype=np.float64, count=impact_count)
+        # Rollback logic: if the last 10 adaptations led to negative avg_pl, revert to previous value
+        rolled_back = False
+        risk_impacts = list(impact_by_param.get('max_risk_per_trade_percent', ()))
+        recent_impacts = risk_impacts[-10:]
+        if len(recent_impacts) == 10 and all(a['avg_pl'] < 0 for a in recent_impacts):
+            # Find the last value before these 10
+            prev = risk_impacts[:-10]
+            if prev:
+                rollback_val = prev[-1]['value']
+                rs['max_risk_per_trade_percent'] = rollback_val
+                al.append({
+                    'timestamp': ts,
+                    'cycle': cycle,
+                    'type': 'rollback',
+                    'param': 'max_risk_per_trade_percent',
+                    'rolled_back_to': rollback_val,
+                    'reason': '10 consecutive negative avg_pl after adaptation'
+                })
+                force_save = True
+                rolled_back = True
+                new_risk = rollback_val  # Stored, returned and shadow-tested value all follow the rollback
+                print(f"Rolled back max_risk_per_trade_percent to {rollback_val} due to poor performance.")
+        # --- Multi-Parameter Change Detection ---
+        # Detect and log if multiple parameters are changed in a single cycle
+        param_changes_this_cycle = cycle_param_updates
+        if len(param_changes_this_cycle) > 1:
+            al.append({
+                'timestamp': ts,
+                'type': 'multi_param_update',
+                'params_changed': [a['param'] for a in param_changes_this_cycle],
+                'new_values': {a['param']: a['new_value'] for a in param_changes_this_cycle},
+                'reason': 'Multiple parameter changes in single cycle',
+                'cycle': cycle
+            })
+            # Track combined impact for later analysis
+            if 'multi_param_impact' not in state:
+                state['multi_param_impact'] = []
+            state['multi_param_impact'].append({
+                'timestamp': ts,
+                'cycle': cycle,
+                'params_changed': [a['param'] for a in param_changes_this_cycle],
+                'new_values': {a['param']: a['new_value'] for a in param_changes_this_cycle},
+                'avg_pl': avg_pl
             })
-        # Contradiction: parameter oscillates up/down repeatedly
-        if all((last_vals[i] - last_vals[i-1]) * (last_vals[i-1] - last_vals[i-2]) < 0 for i in range(2, 5)):
-            from portfolio_manager import log_anomaly
-            log_anomaly(state, 'llm_oscillation', f"Parameter oscillation detected in last 5 cycles: {last_vals}")
-            state['adaptation_log'].append({
-                'timestamp': datetime.now().isoformat(),
+            state['multi_param_impact'] = state['multi_param_impact'][-20:]
+
+        # --- Adaptive Learning Rate ---
+        # The longer the run of negative avg_pl impacts, the smaller the share of this cycle's change that is applied.
+        # Runs before the decay below so the blend never overwrites a decayed max_risk_per_trade_percent
+        not_negative = np.flatnonzero(impact_pls >= 0)
+        neg_streak = impact_count - (not_negative[-1] + 1 if not_negative.size else 0)
+        alpha = _DRAWDOWN_ALPHA[min(len(_DRAWDOWN_ALPHA) - 1, neg_streak // _DRAWDOWN_STREAK_STEP)]
+        if alpha < 1.0 and not state.get('adaptation_slowdown_active'):
+            al.append({
+                'timestamp': ts,
                 'type': 'adaptation_slowdown',
-                'reason': 'LLM suggestions oscillating, slowing adaptation',
-                'cycle': state.get('cycle_count', 0)
+                'reason': f'Drawdown detected ({neg_streak} negative impacts), scaling adaptation steps',
+                'cycle': cycle
             })
+        state['adaptation_slowdown_active'] = alpha < 1.0
+        if alpha < 1.0 and not rolled_back:  # A rollback already reset the value this cycle
+            # Scale the step from the value before this cycle's adaptation, not the already adapted one
+            new_risk = risk + alpha * (new_risk - risk)
+            rs['max_risk_per_trade_percent'] = new_risk
+            update = {
+                'timestamp': ts,
+                'type': 'param_update',
+                'param': 'max_risk_per_trade_percent',
+                'new_value': new_risk,
+                'alpha': alpha,
+                'reason': f'Adaptive learning rate: applied {alpha:.0%} of the change after {neg_streak} negative impacts',
+                'cycle': cycle
+            }
+            al.append(update)
+            cycle_param_updates.append(update)
+
+        # --- Adaptive Parameter Decay ---
+        # If a parameter is at its min/max for >10 cycles, decay toward default unless LLM reinforces
+        for param, default_val, low, high in _DECAY_TARGETS:
+            # Check if at min/max for >10 cycles
+            impacts = list(impact_by_param.get(param, ()))
+            if len(impacts) >= 10:
+                vals = [a['value'] for a in impacts[-10:]]
+                if all(v == low or v == high for v in vals):
+                    # Decay toward default by 10% of the distance
+                    current_val = rs.get(param, default_val)
+                    new_val = current_val + 0.1 * (default_val - current_val)
+                    # Only decay if LLM hasn't just reinforced the extreme
+                    if not any(abs(a['value'] - current_val) < 1e-6 for a in impacts[-3:]):
+                        rs[param] = new_val
+                        if param == 'max_risk_per_trade_percent':
+                            new_risk = new_val
+                        al.append({
+                            'timestamp': ts,
+                            'type': 'param_decay',
+                            'param': param,
+                            'decayed_to': new_val,
+                            'reason': 'Parameter at extreme for >10 cycles, decaying toward default',
+                            'cycle': cycle
+                        })
+                        print(f"Decayed {param} toward default: {new_val}")
+        # --- Reflection Quality/Consistency Check ---
+        # If LLM suggestions are highly volatile or contradictory over 5 cycles, log anomaly and slow adaptation
+        volatile, oscillating, _ = _check_anomalies(impact_vals, impact_pls)
+        if impact_count >= 5:
+            last_vals = impact_vals[-5:]
+            # Volatility: large swings
+            if volatile:
+                swings = np.abs(np.diff(last_vals))
+                log_anomaly(state, 'llm_volatility', f"Large parameter swings in last 5 cycles: {swings.tolist()}")
+                # Optionally slow adaptation (e.g., halve the next change)
+                al.append({
+                    'timestamp': ts,
+                    'type': 'adaptation_slowdown',
+                    'reason': 'LLM suggestions volatile, slowing adaptation',
+                    'cycle': cycle
+                })
+            # Contradiction: parameter oscillates up/down repeatedly
+            if oscillating:
+                log_anomaly(state, 'llm_oscillation', f"Parameter oscillation detected in last 5 cycles: {last_vals.tolist()}")
+                al.append({
+                    'timestamp': ts,
+                    'type': 'adaptation_slowdown',
+                    'reason': 'LLM suggestions oscillating, slowing adaptation',
+                    'cycle': cycle
+                })
+        # --- More Granular Anomaly Types ---
+        # 1. No adaptation for a long period (potential stagnation)
+        # Nothing logged since the pass above is a param_update, so only check newest_update is still within the last 20
+        if len(al) > 20:
+            if newest_update is None or all(a is not newest_update for a in islice(reversed(al), 20)):
+                log_anomaly(state, 'no_adaptation', 'No parameter adaptation in last 20 cycles.')
+        # 2. Repeated LLM errors or unparseable suggestions
+        if reflections:
+            error_count = sum(1 for r in reflections[-10:] if 'error' in r.get('llm_reflection', '').lower() or 'unparseable' in r.get('llm_reflection', '').lower())
+            if error_count > 3:
+                log_anomaly(state, 'llm_error_streak', f"LLM errors/unparseable suggestions in {error_count} of last 10 reflections.")
+        # 3. Parameter stuck at a value despite poor performance
+        for param, *_ in _DECAY_TARGETS:
+            impacts = impact_by_param.get(param, ())
+            if len(impacts) >= 10:
+                vals = np.fromiter((a['value'] for a in impacts), dtype=np.float64, count=len(impacts))
+                pls_for_param = np.fromiter((a['avg_pl'] for a in impacts), dtype=np.float64, count=len(impacts))
+                if _check_anomalies(vals, pls_for_param)[2]:
+                    log_anomaly(state, 'param_stuck', f"{param} stuck at {impacts[-10]['value']} for 10 cycles with negative avg_pl.")
+    # --- Loss Cooldown: If last trade was a loss, set last_loss_cycle ---
+    if last_trades and last_trades[-1]['trade_outcome_pl'] < 0:
+        rs['last_loss_cycle'] = cycle
     # --- Human-Readable Adaptation Summary ---
-    if state.get('cycle_count', 0) % 10 == 0 and state.get('cycle_count', 0) > 0:
-        summary = []
-        summary.append(f"=== Adaptation Summary (Cycle {state['cycle_count']}) ===")
+    if LOG_ADAPTATION_SUMMARY and cycle % 10 == 0 and cycle > 0:
+        summary = io.StringIO()
+        summary.write(f"=== Adaptation Summary (Cycle {cycle}) ===")
         # Recent adaptations
-        recent_adapt = state.get('adaptation_log', [])[-10:]
+        recent_adapt = al[-10:]
         for a in recent_adapt:
-            summary.append(f"[{a.get('timestamp','')}] {a.get('type','')}: {a.get('param','')} -> {a.get('new_value', a.get('decayed_to', a.get('rolled_back_to', '')))} | {a.get('reason','')}")
+            summary.write(f"\n[{a.get('timestamp','')}] {a.get('type','')}: {a.get('param','')} -> {a.get('new_value', a.get('decayed_to', a.get('rolled_back_to', '')))} | {a.get('reason','')}")
         # Recent impacts
-        recent_impacts = state.get('adaptation_impact', [])[-10:]
+        recent_impacts = ai[-10:]
         for i, imp in enumerate(recent_impacts):
-            summary.append(f"Impact {i+1}: {imp['param']}={imp['value']} | avg_pl={imp['avg_pl']:.2f}")
+            summary.write(f"\nImpact {i+1}: {imp['param']}={imp['value']} | avg_pl={imp['avg_pl']:.2f}")
         # Recent anomalies
         recent_anom = state.get('anomaly_log', [])[-5:] if 'anomaly_log' in state else []
         for an in recent_anom:
-            summary.append(f"ANOMALY [{an.get('timestamp','')}] {an.get('anomaly_type','')}: {an.get('details','')}")
+            summary.write(f"\nANOMALY [{an.get('timestamp','')}] {an.get('anomaly_type','')}: {an.get('details','')}")
         # Print and log summary
-        summary_str = '\n'.join(summary)
+        summary_str = summary.getvalue()
         print(summary_str)
         if 'adaptation_summaries' not in state:
             state['adaptation_summaries'] = []
         state['adaptation_summaries'].append({
-            'cycle': state['cycle_count'],
-            'timestamp': datetime.now().isoformat(),
+            'cycle': cycle,
+            'timestamp': ts,
             'summary': summary_str
         })
         # Keep only last 10 summaries
         state['adaptation_summaries'] = state['adaptation_summaries'][-10:]
-    # --- More Granular Anomaly Types ---
-    # 1. No adaptation for a long period (potential stagnation)
-    if len(state.get('adaptation_log', [])) > 20:
-        recent_types = [a['type'] for a in state['adaptation_log'][-20:]]
-        if all(t != 'param_update' for t in recent_types):
-            from portfolio_manager import log_anomaly
-            log_anomaly(state, 'no_adaptation', 'No parameter adaptation in last 20 cycles.')
-    # 2. Repeated LLM errors or unparseable suggestions
-    if reflections:
-        error_count = sum(1 for r in reflections[-10:] if 'error' in r.get('llm_reflection', '').lower() or 'unparseable' in r.get('llm_reflection', '').lower())
-        if error_count > 3:
-            from portfolio_manager import log_anomaly
-            log_anomaly(state, 'llm_error_streak', f"LLM errors/unparseable suggestions in {error_count} of last 10 reflections.")
-    # 3. Parameter stuck at a value despite poor performance
-    for param in ['max_risk_per_trade_percent', 'min_sentiment_for_buy', 'max_position_per_asset_percent']:
-        impacts = [a for a in state.get('adaptation_impact', []) if a['param'] == param]
-        if len(impacts) >= 10:
-            vals = [a['value'] for a in impacts[-10:]]
-            if all(v == vals[0] for v in vals) and sum(a['avg_pl'] for a in impacts[-10:]) < 0:
-                from portfolio_manager import log_anomaly
-                log_anomaly(state, 'param_stuck', f"{param} stuck at {vals[0]} for 10 cycles with negative avg_pl.")
-    # --- Adaptive Learning Rate ---
-    # If in drawdown (avg_pl negative for last 10 cycles), slow adaptation
-    if len(state.get('adaptation_impact', [])) >= 10:
-        last_10_pl = [a['avg_pl'] for a in state['adaptation_impact'][-10:]]
-        if all(pl < 0 for pl in last_10_pl):
-            # Reduce magnitude of next parameter change by half
-            if 'adaptation_slowdown_active' not in state or not state['adaptation_slowdown_active']:
-                state['adaptation_slowdown_active'] = True
-                state['adaptation_log'].append({
-                    'timestamp': datetime.now().isoformat(),
-                    'type': 'adaptation_slowdown',
-                    'reason': 'Drawdown detected, halving adaptation magnitude',
-                    'cycle': state.get('cycle_count', 0)
-                })
-            # Halve the next change (for max_risk_per_trade_percent)
-            prev_val = state['RISK_SETTINGS']['max_risk_per_trade_percent']
-            target_val = new_risk
-            new_risk = prev_val + 0.5 * (target_val - prev_val)
-            state['RISK_SETTINGS']['max_risk_per_trade_percent'] = new_risk
-            state['adaptation_log'].append({
-                'timestamp': datetime.now().isoformat(),
-                'type': 'param_update',
-                'param': 'max_risk_per_trade_percent',
-                'new_value': new_risk,
-                'reason': 'Adaptive learning rate: halved change due to drawdown',
-                'cycle': state.get('cycle_count', 0)
-            })
-        else:
-            state['adaptation_slowdown_active'] = False
     # --- Shadow/Test Mode for Major Parameter Changes ---
     SHADOW_TEST_CYCLES = 5
     SHADOW_CHANGE_THRESHOLD = 0.03  # e.g., >3% change triggers shadow mode
     if 'shadow_test' not in state:
-        state['shadow_test'] = {'active': False, 'param': None, 'proposed_value': None, 'start_cycle': None, 'sim_results': []}
+        state['shadow_test'] = {'active': False, 'param': None, 'proposed_value': None, 'start_cycle': None, 'sim_results': [], 'write_idx': 0}
+    elif 'write_idx' not in state['shadow_test']:
+        # Shadow test saved before sim_results became a fixed-size buffer
+        done = state['shadow_test']['sim_results'][:SHADOW_TEST_CYCLES]
+        state['shadow_test']['sim_results'] = done + [0.0] * (SHADOW_TEST_CYCLES - len(done)) if state['shadow_test']['active'] else []
+        state['shadow_test']['write_idx'] = len(done) if state['shadow_test']['active'] else 0
 
     # Detect large change
     if not state['shadow_test']['active'] and abs(new_risk - risk) > SHADOW_CHANGE_THRESHOLD:
@@ -340,60 +479,67 @@ def analyze_llm_reflections():
             'active': True,
             'param': 'max_risk_per_trade_percent',
             'proposed_value': new_risk,
-            'start_cycle': state.get('cycle_count', 0),
-            'sim_results': []
+            'start_cycle': cycle,
+            'sim_results': [0.0] * SHADOW_TEST_CYCLES,  # One slot per simulated cycle, filled up to write_idx
+            'write_idx': 0
         }
         # Do NOT apply the change yet
-        state['adaptation_log'].append({
-            'timestamp': datetime.now().isoformat(),
+        al.append({
+            'timestamp': ts,
             'type': 'shadow_test_start',
             'param': 'max_risk_per_trade_percent',
             'proposed_value': new_risk,
             'reason': f'Large change detected (> {SHADOW_CHANGE_THRESHOLD}), starting shadow test',
-            'cycle': state.get('cycle_count', 0)
+            'cycle': cycle
         })
         # Keep real param unchanged for now
         new_risk = risk
     elif state['shadow_test']['active'] and state['shadow_test']['param'] == 'max_risk_per_trade_percent':
         # Simulate performance with shadow param
         # For simplicity, compare actual P&L to what it would be if risk was shadow value (scale P&L by ratio)
-        sim_cycle = state.get('cycle_count', 0) - state['shadow_test']['start_cycle']
-        if sim_cycle < SHADOW_TEST_CYCLES:
+        shadow = state['shadow_test']
+        sim_cycle = cycle - shadow['start_cycle']
+        if sim_cycle < SHADOW_TEST_CYCLES and shadow['write_idx'] < SHADOW_TEST_CYCLES:
             # Simulate this cycle
             if last_trades:
-                last_real_pl = last_trades[-1]['trade_outcome_pl']
-                risk_ratio = state['shadow_test']['proposed_value'] / risk if risk > 0 else 1.0
-                sim_pl = last_real_pl * risk_ratio
-                state['shadow_test']['sim_results'].append(sim_pl)
+                last_real_pl = float(pls[-1])
+                risk_ratio = shadow['proposed_value'] / risk if risk > 0 else 1.0
+                shadow['sim_results'][shadow['write_idx']] = last_real_pl * risk_ratio
+                shadow['write_idx'] += 1
         if sim_cycle + 1 >= SHADOW_TEST_CYCLES:
             # End shadow test and decide
-            avg_real = sum(r['trade_outcome_pl'] for r in last_trades[-SHADOW_TEST_CYCLES:]) / SHADOW_TEST_CYCLES if len(last_trades) >= SHADOW_TEST_CYCLES else 0
-            avg_sim = sum(state['shadow_test']['sim_results']) / len(state['shadow_test']['sim_results']) if state['shadow_test']['sim_results'] else 0
+            avg_real = float(pls[-SHADOW_TEST_CYCLES:].mean()) if pls.size >= SHADOW_TEST_CYCLES else 0
+            filled = shadow['write_idx']
+            avg_sim = sum(shadow['sim_results'][:filled]) / filled if filled else 0
             if avg_sim > avg_real:
                 # Promote shadow param
                 new_risk = state['shadow_test']['proposed_value']
-                state['RISK_SETTINGS']['max_risk_per_trade_percent'] = new_risk
-                state['adaptation_log'].append({
-                    'timestamp': datetime.now().isoformat(),
+                rs['max_risk_per_trade_percent'] = new_risk
+                al.append({
+                    'timestamp': ts,
                     'type': 'shadow_test_promote',
                     'param': 'max_risk_per_trade_percent',
                     'new_value': new_risk,
                     'reason': f'Shadow test outperformed real ({avg_sim:.2f} > {avg_real:.2f}), promoting',
-                    'cycle': state.get('cycle_count', 0)
+                    'cycle': cycle
                 })
+                force_save = True
             else:
                 # Reject shadow param
-                state['adaptation_log'].append({
-                    'timestamp': datetime.now().isoformat(),
+                al.append({
+                    'timestamp': ts,
                     'type': 'shadow_test_reject',
                     'param': 'max_risk_per_trade_percent',
                     'proposed_value': state['shadow_test']['proposed_value'],
                     'reason': f'Shadow test underperformed or equal ({avg_sim:.2f} <= {avg_real:.2f}), rejecting',
-                    'cycle': state.get('cycle_count', 0)
+                    'cycle': cycle
                 })
             # Reset shadow test
-            state['shadow_test'] = {'active': False, 'param': None, 'proposed_value': None, 'start_cycle': None, 'sim_results': []}
-    save_portfolio_state(state)
+            state['shadow_test'] = {'active': False, 'param': None, 'proposed_value': None, 'start_cycle': None, 'sim_results': [], 'write_idx': 0}
+    # Only the most recent cycles' updates are worth keeping
+    recent_cycles = sorted(state['_cycle_param_updates'], key=int)[-5:]
+    state['_cycle_param_updates'] = {c: state['_cycle_param_updates'][c] for c in recent_cycles}
+    maybe_flush_portfolio_state(state, force=force_save)
     return new_risk
 
 if __name__ == "__main__":
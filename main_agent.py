@@ -1,32 +1,48 @@
 import time
 import os
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import asyncio
 import sys  # Moved from __main__ block as per TODO
 import signal  # Moved from __main__ block as per TODO
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Import functions from your other modules
-from data_collector import get_historical_trade_data, start_alpaca_news_ws_background, load_news_from_json
-from indicators import calculate_indicators
-from ai_brain import get_llm_analysis, model, reflect_and_learn # Import reflect_and_learn from ai_brain
-from decision_maker import make_trading_decision
+from data_collector import get_historical_trade_data, save_processed_history, start_alpaca_news_ws_background, load_news_from_json
+from indicators import calculate_indicators_cached
+from ai_brain import get_llm_analysis_batch, model, reflect_and_learn # Import reflect_and_learn from ai_brain
+from decision_maker import make_trading_decision, PortfolioView, RiskSettings
 from trade_executor import get_open_positions, get_account_info, execute_trade, BASE_URL, place_stop_loss_order
-from portfolio_manager import load_portfolio_state, save_portfolio_state, add_trade_log, add_llm_reflection_log, update_portfolio_from_alpaca, add_experience_record, add_decision_to_history, update_trade_outcomes_on_close
-from experience_learner import get_market_state_snapshot, find_similar_experiences, analyze_similar_outcomes # NEW IMPORT
-from config import TRADING_SYMBOLS, CYCLE_INTERVAL_SECONDS, LOOKBACK_PERIOD_HISTORY, NEWS_QUERY_LIMIT_PER_SYMBOL, LLM_REFLECTION_INTERVAL_CYCLES, NEWS_FETCH_INTERVAL_CYCLES, RISK_SETTINGS, SIMILARITY_TOLERANCE, MAX_SIMILAR_RECORDS
+from portfolio_manager import load_portfolio_state, save_portfolio_state, add_trade_log, add_llm_reflection_log, update_portfolio_from_alpaca, apply_fill_to_portfolio, add_experience_record, add_decision_to_history, update_trade_outcomes_on_close
+from experience_learner import get_market_state_snapshot, column_arrays, SNAPSHOT_COLUMNS, find_similar_experiences, analyze_similar_outcomes # NEW IMPORT
+from config import TRADING_SYMBOLS, CYCLE_INTERVAL_SECONDS, LOOKBACK_PERIOD_HISTORY, NEWS_QUERY_LIMIT_PER_SYMBOL, LLM_REFLECTION_INTERVAL_CYCLES, NEWS_FETCH_INTERVAL_CYCLES, RISK_SETTINGS, SIMILARITY_TOLERANCE, MAX_SIMILAR_RECORDS, ALPACA_MAX_CONCURRENT_REQUESTS
 from learning_agent import analyze_llm_reflections
 
 # (Remove all variable definitions for config values, keep only logic)
 
+# Writes the processed histories off the critical path; the cycle itself reads the in-memory frames
+_history_writer = ThreadPoolExecutor(max_workers=1)
+
+# In-memory portfolio state, loaded once and carried across cycles (and into safe_shutdown)
+_portfolio_state = None
+
+def _get_state():
+    """Returns the in-memory portfolio state, loading it from disk on first use."""
+    global _portfolio_state
+    if _portfolio_state is None:
+        _portfolio_state = load_portfolio_state()
+    return _portfolio_state
+
 
 
 def main_trading_cycle():
+    global _portfolio_state
     # STEP 1: Start Trading Cycle
     print(f"\n--- Starting Trading Cycle: {datetime.now().isoformat()} ---")
     
-    # STEP 2: Load Portfolio State
-    portfolio_state = load_portfolio_state()
+    # STEP 2: Load Portfolio State (from memory after the first cycle)
+    portfolio_state = _get_state()
     
     # STEP 3: Anomaly Alert? (Print any new anomalies this cycle)
     last_alerted_cycle = portfolio_state.get('last_anomaly_alert_cycle', 0)
@@ -36,7 +52,6 @@ def main_trading_cycle():
         for anomaly in new_anomalies:
             print(f"[{anomaly['timestamp']}] {anomaly['anomaly_type']}: {anomaly['details']}")
         portfolio_state['last_anomaly_alert_cycle'] = portfolio_state.get('cycle_count', 0)
-        save_portfolio_state(portfolio_state)
 
     # STEP 4: Increment Cycle Count
     portfolio_state['cycle_count'] = portfolio_state.get('cycle_count', 0) + 1
@@ -65,63 +80,77 @@ def main_trading_cycle():
 
     # STEP 6: Data Collection (historical, indicators, news)
     os.makedirs("data", exist_ok=True)
-    all_news_data = pd.DataFrame()
     latest_prices = {}
+    processed_history = {}  # symbol -> history with indicators, consumed in Step 9
     fetch_news_this_cycle = (cycle_count % NEWS_FETCH_INTERVAL_CYCLES == 1)
 
-    for symbol in TRADING_SYMBOLS:
-        print(f"\n--- Collecting data for {symbol} ---")
-        history_df = get_historical_trade_data(symbol, period=LOOKBACK_PERIOD_HISTORY)
-        if not history_df.empty:
-            history_df_with_indicators = calculate_indicators(history_df)
-            history_df_with_indicators.to_csv(f"data/{symbol}_processed_history.csv")
+    print(f"\n--- Collecting data for {', '.join(TRADING_SYMBOLS)} ---")
+    # Fetches are network-bound, so run them concurrently and process each symbol here as its bars arrive
+    with ThreadPoolExecutor(max_workers=min(ALPACA_MAX_CONCURRENT_REQUESTS, len(TRADING_SYMBOLS))) as executor:
+        futures = {executor.submit(get_historical_trade_data, symbol, period=LOOKBACK_PERIOD_HISTORY): symbol for symbol in TRADING_SYMBOLS}
+        history_by_symbol = ((futures[future], future.result()) for future in as_completed(futures))
+        for symbol, history_df in history_by_symbol:
+            if history_df.empty:
+                print(f"Could not get historical data for {symbol}. Skipping.")
+                latest_prices[symbol] = 0
+                continue
+            history_df_with_indicators = calculate_indicators_cached(symbol, history_df)
+            processed_history[symbol] = history_df_with_indicators
+            _history_writer.submit(save_processed_history, history_df_with_indicators, symbol)
             latest_prices[symbol] = history_df_with_indicators['Close'].iloc[-1]
-        else:
-            print(f"Could not get historical data for {symbol}. Skipping.")
-            latest_prices[symbol] = 0
-            continue
 
-    # STEP 7: Fetch News (periodic, from Alpaca WSS buffer)
+    # STEP 7: Fetch News (periodic, from Alpaca WSS buffer) - one frame built straight from the loaded items
+    all_news_data = pd.DataFrame()
     if fetch_news_this_cycle:
         news_json = load_news_from_json(limit=100)  # Load last 100 news items
         if news_json:
             all_news_data = pd.DataFrame(news_json)
-        else:
-            all_news_data = pd.DataFrame()
-    else:
-        all_news_data = pd.DataFrame()
+
+    # Lowercased title + description per news item, built once and searched for every symbol in Step 9
+    news_search_text = np.array([], dtype=str)
+    if not all_news_data.empty:
+        news_search_text = (
+            all_news_data.get('title', pd.Series('', index=all_news_data.index)).fillna('').astype(str) + ' ' +
+            all_news_data.get('description', pd.Series('', index=all_news_data.index)).fillna('').astype(str)
+        ).str.lower().to_numpy(dtype=str)
 
     # STEP 8: Update current prices in portfolio state
     portfolio_state['current_prices'].update(latest_prices)
-    save_portfolio_state(portfolio_state)
+    portfolio_view = PortfolioView.from_portfolio(portfolio_state)  # Rebuilt whenever holdings change below
+    risk_settings = RiskSettings.from_dict(portfolio_state.get('RISK_SETTINGS', RISK_SETTINGS))  # Adapted only after the loop
 
     # STEP 9: For each symbol: LLM/AI Analysis & Decision Making
     print("\n--- Performing LLM Analysis and Decision Making ---")
+    # First pass prepares every symbol's inputs, so all analyses can go out in one batched LLM request
+    llm_payloads = []
+    any_trade_filled = False
+    prepared = {}  # symbol -> (current_price, last bar's SMA_20 / RSI / ATR / ..., market state snapshot, atr_value)
     for symbol in TRADING_SYMBOLS:
         current_price = portfolio_state['current_prices'].get(symbol, 0)
         if current_price == 0:
             print(f"Skipping {symbol} due to no valid current price.")
             continue
 
-        # Load processed data for LLM and Experience Learner
+        # Processed data for LLM and Experience Learner
+        history_df = processed_history.get(symbol)
+        if history_df is None:
+            print(f"Processed history not found for {symbol}. Skipping LLM analysis.")
+            continue
         try:
-            history_df = pd.read_csv(f"data/{symbol}_processed_history.csv", index_col="Date", parse_dates=True)
             recent_history_for_llm = history_df.tail(10) # Last 10 rows for LLM
+            # Column arrays shared by the snapshot and the ATR lookup
+            arrays = column_arrays(history_df, SNAPSHOT_COLUMNS + ('ATR', 'SMA_20'))
+            # Last bar's values as plain scalars, read by the fallback strategy without any pandas indexing
+            last_row = {col: values[-1] for col, values in arrays.items() if len(values)}
             # Get market state snapshot for experience learner
-            current_market_state_snapshot = get_market_state_snapshot(history_df, symbol)
+            current_market_state_snapshot = get_market_state_snapshot(history_df, symbol, arrays=arrays)
             # Extract ATR if available for position sizing
-            atr_value = None
-            if 'ATR' in history_df.columns:
-                atr_value = history_df['ATR'].iloc[-1]
-        except FileNotFoundError:
-            print(f"Processed history not found for {symbol}. Skipping LLM analysis.")
-            continue
+            atr_value = arrays['ATR'][-1] if 'ATR' in arrays else None
         except Exception as e:
             print(f"Error preparing data for {symbol}: {e}. Skipping.")
             continue
 
-        relevant_news_for_llm = all_news_data[all_news_data['title'].str.contains(symbol, case=False, na=False) |
-                                              all_news_data['description'].str.contains(symbol, case=False, na=False)].head(NEWS_QUERY_LIMIT_PER_SYMBOL)
+        relevant_news_for_llm = all_news_data[np.char.find(news_search_text, symbol.lower()) >= 0].head(NEWS_QUERY_LIMIT_PER_SYMBOL)
 
         # --- Consult Experience Learner ---
         learning_insight = ""
@@ -155,16 +184,29 @@ def main_trading_cycle():
                 past_trades_summary += " The trade encountered an issue."
 
         # Add the learning insight to the LLM's prompt
+        llm_payloads.append({
+            'symbol': symbol,
+            'current_price': current_price,
+            'recent_history_df': recent_history_for_llm,
+            'news_df': relevant_news_for_llm,
+            'past_trades_summary': past_trades_summary + "\n\nAlso, consider the following insights from similar past market conditions:\n" + learning_insight
+        })
+        prepared[symbol] = (current_price, last_row, current_market_state_snapshot, atr_value)
+
+    # One Gemini request covers every symbol (cached analyses are answered locally)
+    try:
+        llm_results = get_llm_analysis_batch(llm_payloads) if llm_payloads else {}
+    except Exception as e:
+        print(f"Batch LLM analysis failed: {e}")
+        llm_results = {}
+
+    for symbol, (current_price, last_row, current_market_state_snapshot, atr_value) in prepared.items():
+        llm_analysis = llm_results.get(symbol) or {}
         try:
-            llm_analysis = get_llm_analysis(
-                symbol=symbol,
-                current_price=current_price,
-                recent_history_df=recent_history_for_llm,
-                news_df=relevant_news_for_llm,
-                past_trades_summary=past_trades_summary + "\n\nAlso, consider the following insights from similar past market conditions:\n" + learning_insight
-            )
-            if isinstance(llm_analysis, dict):
-                llm_analysis['raw_prompt_sent'] = llm_analysis.get('raw_prompt_sent', '') or locals().get('prompt', '')
+            if not llm_analysis:
+                raise RuntimeError('No LLM analysis returned.')
+            # get_llm_analysis_batch puts the rendered prompt in every result, cached or fresh
+            llm_analysis.setdefault('raw_prompt_sent', '')
             # Check for LLM failure by action/risks (covers both exception and error dict cases)
             if (
                 llm_analysis.get('action') == 'HOLD' and (
@@ -176,14 +218,13 @@ def main_trading_cycle():
         except Exception as e:
             print(f"LLM analysis failed for {symbol}: {e}. Using fallback technical strategy.")
             # Fallback: simple technical-based decision
-            last_row = recent_history_for_llm.iloc[-1] if not recent_history_for_llm.empty else None
             fallback_decision = "HOLD"
             fallback_reason = "LLM unavailable. Fallback to technicals."
             fallback_sentiment = 0
             fallback_size = 0
-            if last_row is not None:
-                sma20 = last_row['SMA_20'] if 'SMA_20' in last_row else None
-                rsi = last_row['RSI'] if 'RSI' in last_row else None
+            if last_row:
+                sma20 = last_row.get('SMA_20')
+                rsi = last_row.get('RSI')
                 # Let the LLM (if available) suggest a fallback size, else use default logic
                 suggested_size = None
                 if 'fallback_size' in llm_analysis and isinstance(llm_analysis['fallback_size'], (int, float)):
@@ -211,40 +252,42 @@ def main_trading_cycle():
         trade_decision = make_trading_decision(
             symbol=symbol,
             llm_analysis_result=llm_analysis,
-            current_portfolio=portfolio_state,
-            risk_settings=portfolio_state.get('RISK_SETTINGS', RISK_SETTINGS),
+            current_portfolio=portfolio_view,
+            risk_settings=risk_settings,
             atr_value=atr_value
         )
 
         # STEP 10: Trade Execution (Simulated or Real)
         trade_outcome_pl = 0.0  # Default for HOLD
+        trade_filled = False
         prev_holdings = portfolio_state.get('holdings', {}).copy()  # Capture before trade
         if trade_decision['decision'] in ["BUY", "SELL"] and trade_decision['size'] > 0:
             print(f"Executing trade for {symbol}: {trade_decision['decision']} {trade_decision['size']}")
             trade_result = execute_trade(alpaca_symbol(symbol), trade_decision['decision'], trade_decision['size'])
 
             # After executing a new trade (buy/sell), place a stop-loss order
-            if trade_result.get('status') == 'success':
+            trade_filled = trade_result.get('status') == 'success'
+            # Fill price for the stop-loss and the local portfolio update (top-level or in the raw order), else current_price
+            entry_price = float(
+                trade_result.get('filled_avg_price')
+                or (trade_result.get('order_details') or {}).get('filled_avg_price')
+                or current_price
+            )
+            if trade_filled:
                 # Determine stop-loss percent from risk settings
-                stop_loss_pct = portfolio_state.get('RISK_SETTINGS', RISK_SETTINGS).get('max_risk_per_trade_percent', 0.01)
+                stop_loss_pct = risk_settings.max_risk_per_trade_percent
                 stop_loss_pct = stop_loss_pct / 100.0
-                # Get entry price and qty from trade details
-                entry_price = trade_result.get('filled_avg_price', current_price)  # Fallback to current_price if missing
+                # Get qty from trade details
                 qty = trade_decision['size']
                 side = trade_decision['decision'].lower()
                 # Use Alpaca symbol format for stop-loss order
                 place_stop_loss_order(alpaca_symbol(symbol), qty, side, entry_price, stop_loss_pct)
 
-            # STEP 11: Portfolio & State Update (after trade)
-            updated_alpaca_account = get_account_info()
-            updated_alpaca_positions = get_open_positions()
-            if updated_alpaca_account:
-                updated_prices = {symbol: pos['current_price'] for symbol, pos in updated_alpaca_positions.items()}
-                updated_prices.update(latest_prices)
-                portfolio_state = update_portfolio_from_alpaca(portfolio_state, updated_alpaca_account, updated_alpaca_positions, updated_prices)
-            else:
-                print("Warning: Could not fetch updated Alpaca info after trade. Portfolio state might be stale.")
-                sys.exit(1)  # Exit if we can't get account info, as we need it for trading decisions
+            # STEP 11: Portfolio & State Update (after trade) - applied locally, resynced with Alpaca once after the loop
+            if trade_filled:
+                any_trade_filled = True
+                apply_fill_to_portfolio(portfolio_state, symbol, trade_decision['decision'], trade_decision['size'], entry_price)
+                portfolio_view = PortfolioView.from_portfolio(portfolio_state)
 
             # --- Update trade outcomes for closed positions ---
             update_trade_outcomes_on_close(prev_holdings, portfolio_state.get('holdings', {}), portfolio_state['trade_log'], latest_prices=portfolio_state.get('current_prices', {}))
@@ -318,8 +361,20 @@ def main_trading_cycle():
             llm_analysis.get('risks', '')
         )
 
-        # Save state after each symbol's decision/execution
-        save_portfolio_state(portfolio_state)
+        # Checkpoint right after a filled trade; everything else is written once at the end of the cycle
+        if trade_filled:
+            save_portfolio_state(portfolio_state)
+
+    # One authoritative refresh from Alpaca covers every trade filled above
+    if any_trade_filled:
+        updated_alpaca_account = get_account_info()
+        if updated_alpaca_account:
+            updated_alpaca_positions = get_open_positions()
+            updated_prices = {symbol: pos['current_price'] for symbol, pos in updated_alpaca_positions.items()}
+            updated_prices.update(latest_prices)
+            portfolio_state = update_portfolio_from_alpaca(portfolio_state, updated_alpaca_account, updated_alpaca_positions, updated_prices)
+        else:
+            print("Warning: Could not fetch updated Alpaca info after trades. Keeping the locally applied fills.")
 
     # STEP 13: Reflection & Learning (Periodically)
     if portfolio_state['cycle_count'] % LLM_REFLECTION_INTERVAL_CYCLES == 0:
@@ -327,14 +382,18 @@ def main_trading_cycle():
         # The reflect_and_learn function from ai_brain.py
         # will now potentially use the updated trade log which includes P&L,
         # or you could modify it to directly summarize the experience_log.
-        reflect_and_learn(model, portfolio_state)
+        reflect_and_learn(model, portfolio_state, save_state=False)  # Saved once below
         add_llm_reflection_log(portfolio_state, {"cycle": portfolio_state['cycle_count'], "reflection_performed": True}) # Log that reflection occurred
         save_portfolio_state(portfolio_state)
         # --- Adaptive Learning: Call learning_agent after reflection ---
         analyze_llm_reflections()
+        # The learning agent adapts the state on disk, so pick up its version
+        portfolio_state = _portfolio_state = load_portfolio_state()
         # --- Apply adaptive parameters (stop-loss, cooldown, position sizing) ---
         # These will be used in the next cycle automatically as they are loaded from state
 
+    save_portfolio_state(portfolio_state)
+
     # STEP 14: Adaptive Cooldown (if set, skip trading for that many cycles after a loss)
     cooldown_cycles = portfolio_state.get('RISK_SETTINGS', {}).get('cooldown_cycles', 0)
     last_loss_cycle = portfolio_state.get('RISK_SETTINGS', {}).get('last_loss_cycle', -1000)
@@ -382,7 +441,8 @@ if __name__ == "__main__":
         print(f"\n[{datetime.now().isoformat()}] Trading agent stopped safely. Saving state...")
         try:
             # Save portfolio state and any other critical info
-            save_portfolio_state(load_portfolio_state())
+            if _portfolio_state is not None:
+                save_portfolio_state(_portfolio_state)
         except Exception as e:
             print(f"Error during shutdown save: {e}")
         sys.exit(0)
@@ -1,35 +1,194 @@
+import atexit
 import json
 import os
 import sys
+import tempfile
+import threading
+import time
 from datetime import datetime
 import pandas as pd # Import pandas for data handling
-from config import LLM_PROMPT_TEMPLATE
+from config import ADAPTATION_LOG_MAX_ENTRIES, COMPRESS_PORTFOLIO_STATE, LLM_PROMPT_TEMPLATE, STATE_FLUSH_INTERVAL_SECONDS
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib json module
+    orjson = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; similarity search then reads the JSON experience log
+    pa = pq = None
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; the portfolio state is then always written as plain JSON
+    zstandard = None
 
 # Define the path for the portfolio state file
 PORTFOLIO_STATE_FILE = "portfolio_state.json"
 PORTFOLIO_STATE_BACKUP_FILE = "portfolio_state_backup.json"
+COMPRESSED_STATE_SUFFIX = ".zst" # Added to the state and backup file names when COMPRESS_PORTFOLIO_STATE is on
 EXPERIENCE_LOG_FILE = "experience_log.json" # New file for detailed experiences
+EXPERIENCE_INDEX_FILE = "experience_log.parquet" # Columnar copy of the fields used by similarity search
+ADAPTATION_LOG_FILE = "adaptation_log.jsonl" # Append-only; the state file itself no longer embeds the adaptation log
+# Kept in memory but not written to the state file. _adaptation_log_saved counts the entries already in ADAPTATION_LOG_FILE.
+_STATE_FILE_EXCLUDED_KEYS = ("adaptation_log", "_adaptation_log_saved")
+
+def read_json(path):
+    """Reads a JSON file, using orjson when available."""
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r") as f:
+        return json.load(f)
+
+def dumps_json(obj, default=None):
+    """Serializes obj to 2-space indented JSON bytes, laid out the same with or without orjson.
+    orjson also handles NumPy scalars from pandas rows.
+    default is called for objects neither serializer supports (e.g. default=str for pandas Timestamps)."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2, ensure_ascii=False, default=default).encode()
+
+def dumps_json_line(obj):
+    """Serializes obj to one compact line of JSON bytes (without the newline), for append-only JSONL files."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+def write_bytes_atomic(path, data):
+    """Writes data to a temporary file next to path and renames it over path, so readers and crashes never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def write_json(path, obj, default=None):
+    """Writes obj to a JSON file, using orjson when available."""
+    with open(path, "wb") as f:
+        f.write(dumps_json(obj, default=default))
+
+def portfolio_state_path(path=PORTFOLIO_STATE_FILE):
+    """The file the state (or, given PORTFOLIO_STATE_BACKUP_FILE, its backup) is stored in: path or its .zst variant."""
+    compressed = path + COMPRESSED_STATE_SUFFIX
+    return compressed if os.path.exists(compressed) else path
+
+def _read_state_file(path):
+    """Reads a state file written by _write_state_file, decompressing .zst files."""
+    if not path.endswith(COMPRESSED_STATE_SUFFIX):
+        return read_json(path)
+    if zstandard is None:
+        raise ImportError(f"{path} is zstd-compressed; install zstandard to read it")
+    with open(path, "rb") as f:
+        data = zstandard.ZstdDecompressor().decompress(f.read())
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def _write_state_file(path, data):
+    """
+    Atomically writes serialized state to path, or zstd-compressed to path + COMPRESSED_STATE_SUFFIX when
+    COMPRESS_PORTFOLIO_STATE is on (and zstandard is installed). The copy in the other format is removed.
+    """
+    compressed = path + COMPRESSED_STATE_SUFFIX
+    if COMPRESS_PORTFOLIO_STATE and zstandard is not None:
+        # Repeated keys make the JSON compress several-fold; level 3 keeps this cheaper than the disk write it saves
+        write_bytes_atomic(compressed, zstandard.ZstdCompressor(level=3).compress(data))
+        stale = path
+    else:
+        write_bytes_atomic(path, data)
+        stale = compressed
+    if os.path.exists(stale):
+        os.remove(stale)
+
+class _PendingSave:
+    """The latest state handed to maybe_flush_portfolio_state that has not been written yet."""
+    def __init__(self):
+        self.state = None
+        self.last_flush_ts = 0.0
+
+_pending_save = _PendingSave()
+
+def flush_pending_portfolio_state():
+    """Writes the deferred state, if any. Also runs at exit so a deferred save is never lost."""
+    state, _pending_save.state = _pending_save.state, None
+    if state is not None:
+        save_portfolio_state(state)
+
+atexit.register(flush_pending_portfolio_state)
+
+def maybe_flush_portfolio_state(state, force=False):
+    """
+    Debounced save_portfolio_state: writes at most once per STATE_FLUSH_INTERVAL_SECONDS unless force=True,
+    otherwise keeps the state pending. Loads and full saves flush a pending state first, so readers never
+    see an older file than what was handed in here.
+    """
+    _pending_save.state = state
+    if force or time.monotonic() - _pending_save.last_flush_ts >= STATE_FLUSH_INTERVAL_SECONDS:
+        flush_pending_portfolio_state()
+
+# Serializes appends with the compaction in load_adaptation_log, so an append can't land in a file about to be replaced
+_adaptation_log_lock = threading.Lock()
+
+def append_adaptation_log(entries):
+    """Appends adaptation log entries to ADAPTATION_LOG_FILE, one JSON line each, with a single write."""
+    if entries:
+        with _adaptation_log_lock, open(ADAPTATION_LOG_FILE, "ab") as f:
+            f.write(b"".join(dumps_json_line(entry) + b"\n" for entry in entries))
+
+def load_adaptation_log():
+    """
+    Returns the last ADAPTATION_LOG_MAX_ENTRIES entries of ADAPTATION_LOG_FILE, or None if it doesn't exist.
+    Once the file holds more than twice that many lines it is atomically replaced by one with only the returned ones.
+    """
+    if not os.path.exists(ADAPTATION_LOG_FILE):
+        return None
+    with _adaptation_log_lock:
+        with open(ADAPTATION_LOG_FILE, "rb") as f:
+            lines = [line for line in f.read().splitlines() if line.strip()]
+        tail = lines[-ADAPTATION_LOG_MAX_ENTRIES:]
+        if len(lines) > 2 * ADAPTATION_LOG_MAX_ENTRIES:
+            write_bytes_atomic(ADAPTATION_LOG_FILE, b"".join(line + b"\n" for line in tail))
+    loads = orjson.loads if orjson is not None else json.loads
+    entries = []
+    for line in tail:
+        try:
+            entries.append(loads(line))
+        except ValueError:
+            continue  # A line torn by a crash mid-append
+    return entries
+
+def _attach_adaptation_log(state):
+    """Puts the adaptation log from ADAPTATION_LOG_FILE into state. A log still embedded in an older state
+    file is kept instead when there is no log file yet, and counts as unsaved so the next save moves it there."""
+    adaptation_log = load_adaptation_log()
+    if adaptation_log is not None:
+        state["adaptation_log"] = adaptation_log
+        state["_adaptation_log_saved"] = len(adaptation_log)
+    elif "adaptation_log" not in state:
+        state["adaptation_log"] = []
+    return state
 
 def load_portfolio_state():
     """Loads the last saved portfolio state."""
-    if os.path.exists(PORTFOLIO_STATE_FILE):
-        with open(PORTFOLIO_STATE_FILE, "r") as f:
-            state = json.load(f)
-            # Ensure decision_history key exists
-            if "decision_history" not in state:
-                state["decision_history"] = []
-            # Ensure llm_prompt_template exists
-            if "llm_prompt_template" not in state:
-                state["llm_prompt_template"] = LLM_PROMPT_TEMPLATE
-            # Ensure adaptation_log exists
-            if "adaptation_log" not in state:
-                state["adaptation_log"] = []
-            # Ensure anomaly_log exists
-            if "anomaly_log" not in state:
-                state["anomaly_log"] = []
-            return state
+    flush_pending_portfolio_state()
+    state_path = portfolio_state_path()
+    if os.path.exists(state_path):
+        state = _read_state_file(state_path)
+        # Ensure decision_history key exists
+        if "decision_history" not in state:
+            state["decision_history"] = []
+        # Ensure llm_prompt_template exists
+        if "llm_prompt_template" not in state:
+            state["llm_prompt_template"] = LLM_PROMPT_TEMPLATE
+        # Attach the adaptation_log
+        _attach_adaptation_log(state)
+        # Ensure anomaly_log exists
+        if "anomaly_log" not in state:
+            state["anomaly_log"] = []
+        return state
     # Initial state if file doesn't exist
-    return {
+    return _attach_adaptation_log({
         "cash": 10000.0,
         "holdings": {},
         "trade_log": [],
@@ -38,17 +197,27 @@ def load_portfolio_state():
         "cycle_count": 0, # Initialize cycle count
         "decision_history": [],
         "llm_prompt_template": LLM_PROMPT_TEMPLATE,
-        "adaptation_log": [],
         "anomaly_log": []
-    }
+    })
 
 def save_portfolio_state(state):
-    """Saves the current portfolio state and creates a backup."""
-    with open(PORTFOLIO_STATE_FILE, "w") as f:
-        json.dump(state, f, indent=4)
+    """Saves the current portfolio state and creates a backup. New adaptation_log entries are appended to ADAPTATION_LOG_FILE."""
+    if _pending_save.state is state:
+        _pending_save.state = None  # This write supersedes the deferred one
+    else:
+        flush_pending_portfolio_state()  # Keep writes in call order
+    _pending_save.last_flush_ts = time.monotonic()
+    adaptation_log = state.get("adaptation_log")
+    if adaptation_log is not None:
+        # Write only the entries added since this state was loaded or last saved, then bound the in-memory list
+        append_adaptation_log(adaptation_log[state.get("_adaptation_log_saved", 0):])
+        if len(adaptation_log) > ADAPTATION_LOG_MAX_ENTRIES:
+            del adaptation_log[:-ADAPTATION_LOG_MAX_ENTRIES]  # In place, callers may hold a reference to the list
+        state["_adaptation_log_saved"] = len(adaptation_log)
+    data = dumps_json({k: v for k, v in state.items() if k not in _STATE_FILE_EXCLUDED_KEYS})  # Serialize once, write twice
+    _write_state_file(PORTFOLIO_STATE_FILE, data)
     # Backup
-    with open(PORTFOLIO_STATE_BACKUP_FILE, "w") as f:
-        json.dump(state, f, indent=4)
+    _write_state_file(PORTFOLIO_STATE_BACKUP_FILE, data)
     print("Portfolio state saved and backup created.")
 
 def add_trade_log(state, trade_details):
@@ -72,20 +241,95 @@ def update_portfolio_from_alpaca(state, alpaca_account, alpaca_positions, curren
     print("Portfolio state updated from Alpaca (source of truth). All local portfolio values are now overwritten.")
     return state
 
+def apply_fill_to_portfolio(state, symbol, action, qty, price):
+    """
+    Applies a filled BUY / SELL to the local cash and holdings, so later decisions in the same cycle see it
+    without another Alpaca round-trip. update_portfolio_from_alpaca overwrites it with the broker's view at
+    cycle end. Holdings entries are replaced, not mutated, so earlier shallow copies stay intact.
+    """
+    signed_qty = qty if action == 'BUY' else -qty
+    state['cash'] = float(state.get('cash', 0)) - signed_qty * price
+    holdings = state.setdefault('holdings', {})
+    held = holdings.get(symbol, {})
+    held_qty = held.get('qty', 0)
+    new_qty = held_qty + signed_qty
+    if abs(new_qty) < 1e-9:
+        holdings.pop(symbol, None)
+    else:
+        avg_entry = held.get('avg_entry_price', price)
+        if held_qty == 0 or (held_qty > 0) != (new_qty > 0):
+            avg_entry = price  # New position, or flipped through zero
+        elif abs(new_qty) > abs(held_qty):
+            avg_entry = (avg_entry * held_qty + price * signed_qty) / new_qty  # Added to the position
+        holdings[symbol] = {
+            **held,
+            'qty': new_qty,
+            'avg_entry_price': avg_entry,
+            'current_price': price,
+            'market_value': new_qty * price,
+            'unrealized_pl': (price - avg_entry) * new_qty,
+        }
+    state.setdefault('current_prices', {})[symbol] = price
+    return state
+
 # --- NEW FUNCTION FOR EXPERIENCE LOGGING ---
 def load_experience_log():
     """Loads the detailed experience log."""
     if os.path.exists(EXPERIENCE_LOG_FILE):
-        with open(EXPERIENCE_LOG_FILE, "r") as f:
-            return json.load(f)
+        return read_json(EXPERIENCE_LOG_FILE)
     return [] # Return empty list if no log exists
 
+def load_experience_log_by_symbol():
+    """Loads the experience log plus a symbol -> row indices map, so per-symbol scans skip other symbols' records."""
+    records = load_experience_log()
+    by_symbol = {}
+    for i, record in enumerate(records):
+        by_symbol.setdefault(record.get('symbol'), []).append(i)
+    return records, by_symbol
+
 def save_experience_log(log):
     """Saves the detailed experience log."""
-    with open(EXPERIENCE_LOG_FILE, "w") as f:
-        json.dump(log, f, indent=4)
+    write_json(EXPERIENCE_LOG_FILE, log)
+    save_experience_index(log)
     print("Experience log saved.")
 
+def save_experience_index(log):
+    """
+    Writes the similarity-search fields of the experience log (symbol, RSI, MACD signal, 5-day change,
+    action and P&L) to a Parquet file, so searches read a few columns instead of re-parsing the JSON log.
+    Does nothing without pyarrow; on failure the stale index is removed and searches fall back to the JSON log.
+    """
+    if pq is None:
+        return
+    states = [record.get('market_state') or {} for record in log]
+    try:
+        table = pa.table({
+            "record_index": pa.array(range(len(log)), pa.int64()),
+            "symbol": pa.array([record.get('symbol') for record in log], pa.string()),
+            "RSI": pa.array([state.get('RSI') for state in states], pa.float64()),
+            "MACD_signal": pa.array([state.get('MACD_signal') for state in states], pa.string()),
+            "MACD_signal_code": pa.array([state.get('MACD_signal_code') for state in states], pa.int8()),
+            "price_change_5d": pa.array([state.get('price_change_5d') for state in states], pa.float64()),
+            "action_taken": pa.array([record.get('action_taken') for record in log], pa.string()),
+            "trade_outcome_pl": pa.array([record.get('trade_outcome_pl') for record in log], pa.float64()),
+        })
+        pq.write_table(table, EXPERIENCE_INDEX_FILE)
+    except Exception as e:
+        print(f"Could not write experience index: {e}")
+        if os.path.exists(EXPERIENCE_INDEX_FILE):
+            os.remove(EXPERIENCE_INDEX_FILE)
+
+def load_experience_index(symbol):
+    """
+    Reads the similarity-search columns for one symbol from the Parquet index as a DataFrame.
+    Returns None when pyarrow is missing or the index is absent or older than the JSON log.
+    """
+    if pq is None or not os.path.exists(EXPERIENCE_INDEX_FILE):
+        return None
+    if os.path.exists(EXPERIENCE_LOG_FILE) and os.stat(EXPERIENCE_INDEX_FILE).st_mtime_ns < os.stat(EXPERIENCE_LOG_FILE).st_mtime_ns:
+        return None
+    return pq.read_table(EXPERIENCE_INDEX_FILE, filters=[("symbol", "=", symbol)]).to_pandas()
+
 def add_experience_record(
     symbol,
     market_state, # This will be a dictionary of key indicators
@@ -135,13 +379,12 @@ def add_experience_record_util(symbol, market_state, llm_input_prompt, llm_outpu
         "trade_outcome_pl": trade_outcome_pl
     }
     try:
-        with open("experience_log.json", "r", encoding="utf-8") as f:
-            log = json.load(f)
+        log = read_json(EXPERIENCE_LOG_FILE)
     except Exception:
         log = []
     log.append(experience)
-    with open("experience_log.json", "w", encoding="utf-8") as f:
-        json.dump(log, f, indent=4)
+    write_json(EXPERIENCE_LOG_FILE, log)
+    save_experience_index(log)
     print(f"Experience record logged to file for {symbol}.")
 
 def add_decision_to_history(state, symbol, decision_type, llm_sentiment, llm_reasoning, llm_risks):
@@ -200,11 +443,10 @@ def update_trade_outcomes_on_close(prev_holdings, curr_holdings, trade_log, late
 
 def restore_portfolio_state_from_backup():
     """Restores portfolio state from backup file."""
-    if os.path.exists(PORTFOLIO_STATE_BACKUP_FILE):
-        with open(PORTFOLIO_STATE_BACKUP_FILE, "r") as f:
-            backup_state = json.load(f)
-        with open(PORTFOLIO_STATE_FILE, "w") as f:
-            json.dump(backup_state, f, indent=4)
+    backup_path = portfolio_state_path(PORTFOLIO_STATE_BACKUP_FILE)
+    if os.path.exists(backup_path):
+        backup_state = _read_state_file(backup_path)
+        _write_state_file(PORTFOLIO_STATE_FILE, dumps_json(backup_state))
         print("Portfolio state restored from backup.")
     else:
         print("No backup file found.")
@@ -231,6 +473,8 @@ if __name__ == "__main__":
         os.remove(PORTFOLIO_STATE_FILE)
     if os.path.exists(EXPERIENCE_LOG_FILE):
         os.remove(EXPERIENCE_LOG_FILE)
+    if os.path.exists(EXPERIENCE_INDEX_FILE):
+        os.remove(EXPERIENCE_INDEX_FILE)
 
     current_state = load_portfolio_state()
     print("Initial portfolio state:", current_state)
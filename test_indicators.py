@@ -1,6 +1,11 @@
 import unittest
+import numpy as np
 import pandas as pd
-from indicators import calculate_indicators
+try:
+    import pandas_ta as ta
+except ImportError:
+    raise unittest.SkipTest("pandas_ta is not installed")
+from indicators import calculate_indicators, calculate_indicators_cached, IncrementalIndicators, _kernel_indicators
 
 class TestIndicators(unittest.TestCase):
     def setUp(self):
@@ -20,13 +25,67 @@ class TestIndicators(unittest.TestCase):
         print("Columns after indicator calculation:", result.columns.tolist())
         print(result.head())
         # Check that key indicators are present (except MACD, which is checked below)
-        for col in ['SMA_20', 'RSI', 'BBL_5_2.0', 'BBU_5_2.0', 'OBV', 'ATR']:
+        for col in ['SMA_20', 'RSI', 'OBV', 'ATR']:
             self.assertIn(col, result.columns)
+        # Bollinger Bands: newer pandas_ta releases append the lower/upper std to the name (BBL_5_2.0_2.0)
+        for prefix in ['BBL_5_2.0', 'BBU_5_2.0']:
+            self.assertTrue(any(c.startswith(prefix) for c in result.columns), f"No {prefix} column found")
         # MACD: check for any column that starts with 'MACD'
         macd_cols = [c for c in result.columns if c.startswith('MACD')]
         self.assertTrue(len(macd_cols) > 0, "No MACD columns found")
         # Check that the output DataFrame is not empty
         self.assertFalse(result.empty)
 
+    def test_calculate_indicators_cached(self):
+        first = calculate_indicators_cached('TEST', self.df.copy())
+        # Same symbol and last bar: served from the memo
+        self.assertIs(calculate_indicators_cached('TEST', self.df.copy()), first)
+        # A revised last bar under the same timestamp is recomputed too
+        revised = self.df.copy()
+        revised.iloc[-1, revised.columns.get_loc('Close')] += 1
+        self.assertIsNot(calculate_indicators_cached('TEST', revised), first)
+        # A new bar changes the key and triggers a fresh computation
+        longer = pd.concat([self.df, self.df.tail(1).set_axis([self.df.index[-1] + pd.Timedelta(days=1)])])
+        self.assertIsNot(calculate_indicators_cached('TEST', longer), first)
+
+    def test_incremental_indicators_match_full_recompute(self):
+        full = calculate_indicators(self.df.copy())
+        # Seed on all but the last bars, then feed the rest one at a time
+        state = IncrementalIndicators.from_history(self.df.iloc[:-5])
+        for _, bar in self.df.iloc[-5:].iterrows():
+            latest = state.update(bar['High'], bar['Low'], bar['Close'], bar['Volume'])
+        for col in ['SMA_20', 'RSI', 'ATR', 'OBV', 'ADL']:
+            self.assertAlmostEqual(latest[col], full[col].iloc[-1], places=8)
+        self.assertAlmostEqual(latest['MACD'], full['MACD_12_26_9'].iloc[-1], places=8)
+
+    def test_kernel_matches_pandas_ta(self):
+        # Random walk long enough to get past every warm-up window, including SMA_50
+        rng = np.random.default_rng(0)
+        n = 120
+        close = 100 + np.cumsum(rng.normal(0, 1, n))
+        df = pd.DataFrame({
+            'Open': close,
+            'High': close + rng.uniform(0.1, 2, n),
+            'Low': close - rng.uniform(0.1, 2, n),
+            'Close': close,
+            'Volume': rng.integers(1000, 5000, n).astype(float),
+        }, index=pd.date_range(start='2024-01-01', periods=n, freq='D'))
+        expected = {
+            'SMA_20': ta.sma(df['Close'], length=20),
+            'SMA_50': ta.sma(df['Close'], length=50),
+            'RSI': ta.rsi(df['Close'], length=14),
+            'ATR': ta.atr(df['High'], df['Low'], df['Close'], length=14),
+            'WILLR': ta.willr(df['High'], df['Low'], df['Close'], length=14),
+            'MFI': ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14),
+            'ROC': ta.roc(df['Close'], length=10),
+            'OBV': ta.obv(df['Close'], df['Volume']),
+            'CMF': ta.cmf(df['High'], df['Low'], df['Close'], df['Volume'], length=20),
+            'ADL': ta.ad(df['High'], df['Low'], df['Close'], df['Volume']),
+        }
+        result = _kernel_indicators(df)
+        self.assertEqual(sorted(result.columns), sorted(expected))
+        for col, series in expected.items():
+            np.testing.assert_allclose(result[col].to_numpy(), series.to_numpy(dtype=float), rtol=1e-9, equal_nan=True, err_msg=col)
+
 if __name__ == '__main__':
     unittest.main()
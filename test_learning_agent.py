@@ -0,0 +1,93 @@
+import unittest
+from unittest.mock import patch
+from config import RISK_SETTINGS
+from learning_agent import analyze_llm_reflections
+
+class TestAnalyzeLLMReflections(unittest.TestCase):
+    def setUp(self):
+        # Losing trades only, and a reflection without parameter suggestions
+        self.exp_log = [{'symbol': 'AAPL', 'trade_outcome_pl': -5.0} for _ in range(3)]
+        self.state = {
+            'cycle_count': 1,
+            'llm_reflection_log': [{'llm_reflection': 'No suggestions this time.'}],
+            'RISK_SETTINGS': dict(RISK_SETTINGS),
+        }
+
+    def run_cycle(self, cycle):
+        # The state and experience log stay in memory; nothing is written to disk
+        self.state['cycle_count'] = cycle
+        with patch('learning_agent.load_portfolio_state', return_value=self.state), \
+             patch('learning_agent.load_experience_log', return_value=self.exp_log), \
+             patch('learning_agent.maybe_flush_portfolio_state'), \
+             patch('learning_agent.log_anomaly'):
+            return analyze_llm_reflections()
+
+    def test_unchanged_inputs_skip_adaptation_but_advance_shadow_test(self):
+        self.run_cycle(1)
+        risk = self.state['RISK_SETTINGS']['max_risk_per_trade_percent']
+        impact_count = len(self.state['adaptation_impact'])
+        self.state['shadow_test'] = {
+            'active': True, 'param': 'max_risk_per_trade_percent', 'proposed_value': 0.08,
+            'start_cycle': 1, 'sim_results': [0.0] * 5, 'write_idx': 0,
+        }
+        # Same experience log and reflection on the next two cycles
+        self.assertEqual(self.run_cycle(2), risk)
+        self.assertEqual(self.run_cycle(3), risk)
+        # No new adaptation step...
+        self.assertEqual(len(self.state['adaptation_impact']), impact_count)
+        self.assertEqual(self.state['RISK_SETTINGS']['max_risk_per_trade_percent'], risk)
+        # ...but the shadow test simulated both cycles and the loss cooldown moved with the cycle
+        shadow = self.state['shadow_test']
+        self.assertTrue(shadow['active'])
+        self.assertEqual(shadow['write_idx'], 2)
+        self.assertAlmostEqual(shadow['sim_results'][0], -5.0 * 0.08 / risk)
+        self.assertEqual(self.state['RISK_SETTINGS']['last_loss_cycle'], 3)
+
+    def test_main_agent_cycle_order_skips_unchanged_window(self):
+        # Only holds, which main_agent logs with a 0.0 P&L, so the 20-trade window is the same every cycle
+        symbols = ('AAPL', 'MSFT')
+        self.exp_log[:] = [{'symbol': s, 'trade_outcome_pl': 0.0} for s in symbols for _ in range(10)]
+
+        def main_agent_cycle(cycle):
+            # Same order as main_agent: an experience record per symbol, then reflect_and_learn's reflection
+            # and the reflection_performed marker, then the learning agent
+            self.exp_log.extend({'symbol': s, 'trade_outcome_pl': 0.0} for s in symbols)
+            self.state['llm_reflection_log'] += [{'llm_reflection': 'No suggestions this time.'}, {'cycle': cycle, 'reflection_performed': True}]
+            return self.run_cycle(cycle)
+
+        risk = main_agent_cycle(1)
+        impact_count = len(self.state['adaptation_impact'])
+        self.assertEqual(main_agent_cycle(2), risk)
+        self.assertEqual(len(self.state['adaptation_impact']), impact_count)
+        self.assertEqual(self.state['RISK_SETTINGS']['max_risk_per_trade_percent'], risk)
+
+    def seed_negative_impacts(self, count):
+        self.state['adaptation_impact'] = [
+            {'cycle': c, 'param': 'max_risk_per_trade_percent', 'value': 0.05, 'avg_pl': -1.0} for c in range(count)
+        ]
+
+    def test_drawdown_streak_of_ten_halves_the_step(self):
+        # Losing window: the performance step is -5% of the current 0.05, i.e. -0.0025
+        self.seed_negative_impacts(8)  # This cycle's impact makes 9 in a row: no slowdown yet
+        self.assertAlmostEqual(self.run_cycle(1), 0.05 - 0.0025)
+        self.assertFalse(self.state['adaptation_slowdown_active'])
+
+        self.setUp()
+        self.seed_negative_impacts(9)  # 10 in a row: half of the step is applied
+        new_risk = self.run_cycle(1)
+        self.assertAlmostEqual(new_risk, 0.05 - 0.0025 / 2)
+        self.assertAlmostEqual(self.state['RISK_SETTINGS']['max_risk_per_trade_percent'], new_risk)
+        self.assertTrue(self.state['adaptation_slowdown_active'])
+        self.assertEqual([a['type'] for a in self.state['adaptation_log']].count('adaptation_slowdown'), 1)
+
+    def test_rollback_sets_the_returned_value(self):
+        # One profitable impact at 0.07, then nine losing ones: this cycle's loss makes ten and triggers the rollback
+        self.seed_negative_impacts(9)
+        self.state['adaptation_impact'].insert(0, {'cycle': -1, 'param': 'max_risk_per_trade_percent', 'value': 0.07, 'avg_pl': 1.0})
+        new_risk = self.run_cycle(1)
+        self.assertEqual(new_risk, 0.07)
+        self.assertEqual(self.state['RISK_SETTINGS']['max_risk_per_trade_percent'], 0.07)
+        self.assertEqual([a['type'] for a in self.state['adaptation_log']].count('rollback'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
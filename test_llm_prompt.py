@@ -1,6 +1,11 @@
 import unittest
+from types import SimpleNamespace
 import pandas as pd
-from ai_brain import get_llm_analysis
+try:
+    import pandas_ta  # noqa: F401  (ai_brain -> indicators needs it)
+except ImportError:
+    raise unittest.SkipTest("pandas_ta is not installed")
+from ai_brain import get_llm_analysis, _extract_json_object, _stream_json_response, render_prompt
 
 class TestLLMPrompt(unittest.TestCase):
     def test_llm_prompt_structure(self):
@@ -33,5 +38,40 @@ class TestLLMPrompt(unittest.TestCase):
         self.assertIn('Latest Indicator Values', result['raw_prompt_sent'])
         self.assertIn('Most recent headline', result['raw_prompt_sent'])
 
+    def test_extract_json_object(self):
+        # JSON wrapped in markdown fences with a nested object
+        text = 'Here you go:\n```json\n{"action": "BUY", "param_suggestions": {"min_sentiment_for_buy": 55}}\n```'
+        result = _extract_json_object(text)
+        self.assertEqual(result['action'], "BUY")
+        self.assertEqual(result['param_suggestions']['min_sentiment_for_buy'], 55)
+        # Stray braces before the real object are skipped
+        self.assertEqual(_extract_json_object('use {placeholders} then {"a": 1}'), {"a": 1})
+        self.assertIsNone(_extract_json_object('no json here'))
+        # A truncated stream: the nested object is not mistaken for the whole one
+        self.assertIsNone(_extract_json_object('{"results": [{"symbol": "AAPL"}', partial=True))
+        self.assertEqual(_extract_json_object('use {placeholders} then {"a": 1}', partial=True), {"a": 1})
+
+    def test_stream_json_response(self):
+        chunks = ['Thoughts {braces} aside,', ' {"results": [{"symbol": "AAPL"}', ', {"symbol": "MSFT"}]}', ' trailing', ' text']
+        read = []
+
+        class FakeModel:
+            def generate_content(self, prompt, stream=False):
+                for text in chunks:
+                    read.append(text)
+                    yield SimpleNamespace(text=text)
+
+        text, obj = _stream_json_response(FakeModel(), "prompt")
+        self.assertEqual([r['symbol'] for r in obj['results']], ['AAPL', 'MSFT'])
+        # The stream is abandoned as soon as the object is complete
+        self.assertEqual(len(read), 3)
+        self.assertTrue(text.endswith(']}'))
+
+    def test_render_prompt(self):
+        # Literal JSON braces pass through untouched; str.format-style doubled braces are collapsed
+        template = 'Analyze {symbol} at ${current_price}.\n{\n  "action": "BUY"\n}\n{{"risks": "..."}}'
+        prompt = render_prompt(template, symbol="AAPL", current_price=155.0)
+        self.assertEqual(prompt, 'Analyze AAPL at $155.0.\n{\n  "action": "BUY"\n}\n{"risks": "..."}')
+
 if __name__ == '__main__':
     unittest.main()
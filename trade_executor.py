@@ -1,10 +1,8 @@
 import os
-from dotenv import load_dotenv
+import sys
+import pandas as pd
 import alpaca_trade_api as tradeapi
-from config import ALPACA_API_KEY, ALPACA_SECRET_KEY, BASE_URL
-
-# Load environment variables
-load_dotenv()
+from config import ALPACA_API_KEY, ALPACA_SECRET_KEY, BASE_URL  # config loads .env once
 
 # Initialize Alpaca API
 api = tradeapi.REST(ALPACA_API_KEY, ALPACA_SECRET_KEY, base_url=BASE_URL, api_version='v2')
@@ -54,19 +52,24 @@ def get_account_info():
         return None
 
 
+_HOLDING_FIELDS = ["qty", "avg_entry_price", "current_price", "market_value", "unrealized_pl"]
+
+def _positions_to_holdings(positions):
+    """
+    Converts Alpaca position entities to symbol -> {field: float} in one DataFrame pass over their raw JSON.
+    Symbols are interned at ingestion so later holdings / price lookups hash and compare by identity.
+    """
+    if not positions:
+        return {}
+    df = pd.DataFrame.from_records([p._raw for p in positions], columns=["symbol", *_HOLDING_FIELDS], index="symbol")
+    return {sys.intern(symbol): fields for symbol, fields in df.astype(float).to_dict(orient="index").items()}
+
+
 def get_open_positions():
     """Fetches all open positions."""
     try:
         positions = api.list_positions()
-        holdings = {}
-        for p in positions:
-            holdings[p.symbol] = {
-                "qty": float(p.qty),
-                "avg_entry_price": float(p.avg_entry_price),
-                "current_price": float(p.current_price),
-                "market_value": float(p.market_value),
-                "unrealized_pl": float(p.unrealized_pl)
-            }
+        holdings = _positions_to_holdings(positions)
         print(f"Open Positions: {holdings}")
         return holdings
     except Exception as e:
@@ -80,15 +83,7 @@ def get_alpaca_active_positions():
     """
     try:
         positions = api.list_positions()
-        holdings = {}
-        for p in positions:
-            holdings[p.symbol] = {
-                "qty": float(p.qty),
-                "avg_entry_price": float(p.avg_entry_price),
-                "current_price": float(p.current_price),
-                "market_value": float(p.market_value),
-                "unrealized_pl": float(p.unrealized_pl)
-            }
+        holdings = _positions_to_holdings(positions)
         return holdings
     except Exception as e:
         print(f"Error fetching open positions from Alpaca: {e}")